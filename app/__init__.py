@@ -1,8 +1,4 @@
 import os
-from collections.abc import Callable
-from contextlib import suppress
-from hashlib import sha1
-from io import BytesIO
 
 from flask import Flask, jsonify
 from flask_httpauth import HTTPTokenAuth
@@ -12,9 +8,9 @@ from notifications_utils import request_helper
 from notifications_utils.celery import NotifyCelery
 from notifications_utils.clients.signing.signing_client import Signing
 from notifications_utils.clients.statsd.statsd_client import StatsdClient
-from notifications_utils.s3 import S3ObjectNotFound, s3download, s3upload
 
 from app import weasyprint_hack
+from app.cache import LetterCache
 
 notify_celery = NotifyCelery()
 metrics = GDSMetrics()
@@ -55,6 +51,10 @@ def create_app():
 
     application.cache = init_cache(application)
 
+    from app.commands import setup_commands
+
+    setup_commands(application)
+
     @auth.verify_token
     def verify_token(token):
         return token in application.config["TEMPLATE_PREVIEW_INTERNAL_SECRETS"]
@@ -66,40 +66,7 @@ auth = HTTPTokenAuth(scheme="Token")
 
 
 def init_cache(application):
-    def cache(*args, folder=None, extension="file"):
-        cache_key = "{}/{}.{}".format(
-            folder,
-            sha1("".join(str(arg) for arg in args).encode("utf-8")).hexdigest(),
-            extension,
-        )
-
-        def wrapper(original_function) -> Callable[[], BytesIO]:
-            def new_function() -> BytesIO:
-                with suppress(S3ObjectNotFound):
-                    return BytesIO(
-                        s3download(
-                            application.config["LETTER_CACHE_BUCKET_NAME"],
-                            cache_key,
-                        ).read()
-                    )
-
-                data = original_function()
-
-                s3upload(
-                    data,
-                    application.config["AWS_REGION"],
-                    application.config["LETTER_CACHE_BUCKET_NAME"],
-                    cache_key,
-                )
-
-                data.seek(0)
-                return BytesIO(data.read())
-
-            return new_function
-
-        return wrapper
-
-    return cache
+    return LetterCache(application)
 
 
 def init_app(app):
@@ -0,0 +1,854 @@
+import atexit
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from contextlib import contextmanager, suppress
+from functools import cached_property
+from hashlib import blake2b
+from importlib import metadata
+from io import BytesIO
+from shutil import copyfileobj
+from tempfile import NamedTemporaryFile
+from typing import BinaryIO
+
+import weasyprint
+from notifications_utils.s3 import S3ObjectNotFound, s3download, s3upload
+
+
+class LetterCache:
+    """
+    Caches rendered letters in `LETTER_CACHE_BUCKET_NAME`, with optional in-memory and on-disk tiers in front of S3.
+
+    Use an instance as a decorator factory:
+
+        @current_app.cache(html, folder="templated", extension="pdf")
+        def _get():
+            return render(html)
+
+        pdf = _get()
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+        self.memory_cache = None
+        if application.config["LETTER_CACHE_MEMORY_MAX_BYTES"]:
+            self.memory_cache = MemoryCache(application.config["LETTER_CACHE_MEMORY_MAX_BYTES"])
+
+        self.disk_cache = None
+        if application.config["LETTER_CACHE_DISK_PATH"]:
+            self.disk_cache = DiskCache(
+                application.config["LETTER_CACHE_DISK_PATH"],
+                application.config["LETTER_CACHE_DISK_MAX_BYTES"],
+            )
+
+        self.write_behind_uploader = None
+        if application.config["LETTER_CACHE_WRITE_BEHIND"]:
+            self.write_behind_uploader = WriteBehindUploader(
+                self.upload,
+                application,
+                max_queue_size=application.config["LETTER_CACHE_WRITE_BEHIND_QUEUE_SIZE"],
+                max_attempts=application.config["LETTER_CACHE_WRITE_BEHIND_MAX_ATTEMPTS"],
+            )
+            atexit.register(
+                self.write_behind_uploader.drain,
+                timeout=application.config["LETTER_CACHE_WRITE_BEHIND_DRAIN_TIMEOUT_SECONDS"],
+            )
+
+        self.single_flight = SingleFlight(
+            lock_path=application.config["LETTER_CACHE_LOCK_PATH"],
+            timeout=application.config["LETTER_CACHE_LOCK_TIMEOUT_SECONDS"],
+        )
+
+        self.stats = CacheStats(application.config["LETTER_CACHE_STATS_WINDOW_SECONDS"])
+
+        self.negative_cache = None
+        if application.config["LETTER_CACHE_NEGATIVE_TTL_SECONDS"]:
+            self.negative_cache = NegativeCache(
+                application.config["LETTER_CACHE_NEGATIVE_TTL_SECONDS"],
+                disk_cache=self.disk_cache,
+            )
+
+        self.asset_cache = None
+        if application.config["LETTER_ASSET_CACHE_TTL_SECONDS"]:
+            self.asset_cache = AssetCache(
+                application.config["LETTER_ASSET_CACHE_TTL_SECONDS"],
+                disk_cache=self.disk_cache,
+                max_bytes=application.config["LETTER_ASSET_CACHE_MAX_BYTES"],
+            )
+
+    @cached_property
+    def namespace(self):
+        """
+        Every key is prefixed with a namespace derived from the versions of the libraries and binaries that render
+        letters and the rasteriser in use, so upgrading or switching any of them starts a new cache rather than serving
+        stale renders. Bump `LETTER_CACHE_VERSION` for changes they don't cover, like fonts.
+        """
+        return (
+            self.application.config["LETTER_CACHE_NAMESPACE"]
+            or cache_digest(
+                json.dumps(renderer_versions(), sort_keys=True),
+                self.application.config["LETTER_CACHE_VERSION"],
+                self.application.config["PREVIEW_RASTERISER"],
+            )[:12]
+        )
+
+    def __call__(self, *args, folder=None, extension="file", digest=None, coalesce=True):
+        """
+        The key is `{namespace}/{folder}/{digest}.{extension}`, where the digest is derived from `args` unless it's
+        passed in. Objects returned by the wrapped function carry their digest as `cache_digest`, so anything rendered
+        from them can reuse it instead of hashing the whole object again.
+
+        Pass `coalesce=False` if the wrapped function is cheap apart from calling the cache itself, so that it isn't
+        holding this key's lock while it waits for another.
+        """
+        digest = digest or cache_digest(*args)
+        cache_key = f"{self.namespace}/{folder}/{digest}.{extension}"
+        previous_cache_key = self.previous_cache_key(folder, digest, extension)
+
+        def wrapper(original_function: Callable[[], BytesIO]) -> Callable[[], BinaryIO]:
+            def new_function() -> BinaryIO:
+                data = self.get_or_create(
+                    cache_key, original_function, previous_cache_key=previous_cache_key, coalesce=coalesce
+                )
+                data.cache_digest = digest
+                return data
+
+            return new_function
+
+        return wrapper
+
+    def previous_cache_key(self, folder, digest, extension):
+        """
+        While migrating to a new namespace, only `LETTER_CACHE_MIGRATION_RATE` of keys are rendered again. The rest
+        are served from the previous namespace if they're there. Raise the rate gradually to spread out re-rendering
+        after an upgrade, rather than missing on every key at once.
+
+        Keys are picked by their digest, so the same letter is always either migrated or not at a given rate.
+        """
+        previous_namespace = self.application.config["LETTER_CACHE_PREVIOUS_NAMESPACE"]
+        if not previous_namespace or previous_namespace == self.namespace:
+            return None
+
+        if int(digest[:8], 16) / 0x100000000 < self.application.config["LETTER_CACHE_MIGRATION_RATE"]:
+            return None
+
+        return f"{previous_namespace}/{folder}/{digest}.{extension}"
+
+    def get_or_create(
+        self, cache_key, original_function: Callable[[], BytesIO], previous_cache_key=None, coalesce=True
+    ) -> BinaryIO:
+        """
+        Returns a seekable file-like object. This is the rendered buffer itself on a miss, and on a hit it's either a
+        buffer sharing memory with the in-memory tier or an open file from the disk tier, so callers can pass it
+        straight to `send_file` without it being copied again.
+        """
+        stat_prefix = self.stat_prefix(cache_key)
+
+        if (data := self.get_with_fallback(cache_key, previous_cache_key)) is not None:
+            self.incr(f"{stat_prefix}.hit")
+            return data
+
+        if not coalesce:
+            return self.create(cache_key, original_function)
+
+        with self.single_flight(cache_key) as waited:
+            # if someone else was rendering this key, they'll have cached it by the time we get the lock
+            if waited and (data := self.get(cache_key)) is not None:
+                self.incr("letter-cache.single-flight.coalesced")
+                self.incr(f"{stat_prefix}.hit")
+                return data
+
+            return self.create(cache_key, original_function)
+
+    def create(self, cache_key, original_function: Callable[[], BytesIO]) -> BytesIO:
+        stat_prefix = self.stat_prefix(cache_key)
+
+        self.incr(f"{stat_prefix}.miss")
+        start = time.monotonic()
+        data = original_function()
+        self.timing(f"{stat_prefix}.render-time", time.monotonic() - start)
+
+        self.set(cache_key, data)
+        return data
+
+    def get_or_create_many(
+        self, folder, digest, extensions, original_function: Callable[[list], list[BytesIO]]
+    ) -> dict[str, BinaryIO]:
+        """
+        Like calling the cache once for each extension with the same folder and digest, except that everything that
+        isn't cached is created by one call to `original_function`. It's passed the extensions that missed, and
+        returns an object for each of them, in the same order.
+
+        Returns a dict of extension to file-like object, like `get_or_create` returns.
+        """
+        cache_keys = {extension: f"{self.namespace}/{folder}/{digest}.{extension}" for extension in extensions}
+        objects = {}
+
+        for extension, cache_key in cache_keys.items():
+            previous_cache_key = self.previous_cache_key(folder, digest, extension)
+            if (data := self.get_with_fallback(cache_key, previous_cache_key)) is not None:
+                self.incr(f"{self.stat_prefix(cache_key)}.hit")
+                objects[extension] = data
+
+        if missing := [extension for extension in extensions if extension not in objects]:
+            for extension in missing:
+                self.incr(f"{self.stat_prefix(cache_keys[extension])}.miss")
+
+            start = time.monotonic()
+            created = original_function(missing)
+            self.timing(f"{self.stat_prefix(cache_keys[missing[0]])}.render-time", time.monotonic() - start)
+
+            for extension, data in zip(missing, created, strict=True):
+                self.set(cache_keys[extension], data)
+                objects[extension] = data
+
+        for data in objects.values():
+            data.cache_digest = digest
+
+        return {extension: objects[extension] for extension in extensions}
+
+    def get_with_fallback(self, cache_key, previous_cache_key=None) -> BinaryIO | None:
+        if (data := self.get(cache_key)) is not None:
+            return data
+
+        if previous_cache_key and (data := self.get(previous_cache_key)) is not None:
+            self.incr("letter-cache.migration.previous-hit")
+            return data
+
+        return None
+
+    def set(self, cache_key, data: BytesIO):
+        # `getvalue` shares the buffer's memory rather than copying it, as long as nothing writes to it afterwards
+        rendered = data.getvalue()
+        self.set_in_local_caches(cache_key, rendered)
+
+        if self.write_behind_uploader:
+            self.write_behind_uploader.put(cache_key, rendered)
+        else:
+            self.upload(cache_key, rendered)
+
+        data.seek(0)
+
+    def get_failure(self, *args, folder=None) -> dict | None:
+        """
+        Returns the result saved by `set_failure` for the same `args`, if it hasn't expired. Use this to reject files
+        that are known to be invalid without parsing them again.
+        """
+        if not self.negative_cache:
+            return None
+
+        if (result := self.negative_cache.get(self.failure_cache_key(args, folder))) is None:
+            self.incr("letter-cache.negative.miss")
+            return None
+
+        self.incr("letter-cache.negative.hit")
+        return result
+
+    def set_failure(self, result: dict, *args, folder=None):
+        if self.negative_cache:
+            self.negative_cache.set(self.failure_cache_key(args, folder), result)
+
+    def failure_cache_key(self, args, folder):
+        return f"{self.namespace}/{folder}/{cache_digest(*args)}.failure.json"
+
+    def fetch_asset(self, url) -> dict:
+        """
+        A WeasyPrint URL fetcher which keeps what it fetches over HTTP, like logos, in the asset cache. Fetches that
+        fail aren't cached, so WeasyPrint still fails to load an image that's genuinely missing.
+        """
+        if not self.asset_cache or not url.startswith(("http://", "https://")):
+            return weasyprint.default_url_fetcher(url)
+
+        key = f"assets/{cache_digest(url)}"
+        if (result := self.asset_cache.get(key)) is not None:
+            self.incr("letter-cache.assets.hit")
+            return result
+
+        self.incr("letter-cache.assets.miss")
+        result = weasyprint.default_url_fetcher(url)
+        if "file_obj" in result:
+            with result.pop("file_obj") as f:
+                result["string"] = f.read()
+
+        self.asset_cache.set(key, result)
+        return result
+
+    def upload(self, cache_key, data: bytes):
+        start = time.monotonic()
+        # give the upload its own reader over the rendered bytes, so it can't move the position of, or close, the
+        # buffer we return
+        s3upload(
+            BytesIO(data),
+            self.application.config["AWS_REGION"],
+            self.application.config["LETTER_CACHE_BUCKET_NAME"],
+            cache_key,
+        )
+
+        stat_prefix = self.stat_prefix(cache_key)
+        self.timing(f"{stat_prefix}.upload-time", time.monotonic() - start)
+        self.incr(f"{stat_prefix}.upload-bytes", len(data))
+
+    def get(self, cache_key) -> BinaryIO | None:
+        if (data := self.get_from_local_caches(cache_key)) is not None:
+            return data
+
+        start = time.monotonic()
+        try:
+            body = s3download(
+                self.application.config["LETTER_CACHE_BUCKET_NAME"],
+                cache_key,
+            )
+        except S3ObjectNotFound:
+            self.incr("letter-cache.s3.miss")
+            return None
+
+        self.incr("letter-cache.s3.hit")
+
+        if self.disk_cache and not self.memory_cache:
+            # stream the object to disk in chunks, rather than holding all of it in memory
+            data = self.disk_cache.set_from_file(cache_key, body)
+            size = os.fstat(data.fileno()).st_size
+        else:
+            data = body.read()
+            size = len(data)
+            self.set_in_local_caches(cache_key, data)
+            data = BytesIO(data)
+
+        stat_prefix = self.stat_prefix(cache_key)
+        self.timing(f"{stat_prefix}.download-time", time.monotonic() - start)
+        self.incr(f"{stat_prefix}.download-bytes", size)
+        return data
+
+    def get_from_local_caches(self, cache_key) -> BinaryIO | None:
+        if self.memory_cache:
+            if (data := self.memory_cache.get(cache_key)) is not None:
+                self.incr("letter-cache.memory.hit")
+                return BytesIO(data)
+            self.incr("letter-cache.memory.miss")
+
+        if self.disk_cache:
+            if self.memory_cache:
+                data = self.disk_cache.get(cache_key)
+                if data is not None:
+                    # copy the object into memory, so the next request doesn't have to come this far
+                    self.memory_cache.set(cache_key, data)
+                    data = BytesIO(data)
+            else:
+                data = self.disk_cache.open(cache_key)
+
+            if data is not None:
+                self.incr("letter-cache.disk.hit")
+                return data
+            self.incr("letter-cache.disk.miss")
+
+        return None
+
+    def set_in_local_caches(self, cache_key, data: bytes):
+        if self.memory_cache:
+            self.memory_cache.set(cache_key, data)
+        if self.disk_cache:
+            self.disk_cache.set(cache_key, data)
+
+    @staticmethod
+    def stat_prefix(cache_key):
+        """
+        `{namespace}/templated/{digest}.page01.png` is counted as `letter-cache.templated.png`, so there's a stat for
+        each kind of object rather than for each page.
+        """
+        folder, filename = cache_key.split("/")[-2:]
+        return f"letter-cache.{folder}.{filename.rsplit('.', 1)[-1]}"
+
+    def incr(self, stat, count=1):
+        self.application.statsd_client.incr(stat, count)
+        self.stats.add(stat, count)
+
+    def timing(self, stat, seconds):
+        self.application.statsd_client.timing(stat, seconds)
+        self.stats.add(stat, seconds)
+
+
+def renderer_versions():
+    # imported here because app.status imports the app package, which imports this module
+    from app.status import get_ghostscript_version, get_imagemagick_version
+
+    versions = {
+        distribution: metadata.version(distribution)
+        for distribution in ("WeasyPrint", "pypdf", "PyMuPDF", "Wand", "reportlab", "notifications-utils")
+    }
+    versions["ghostscript"] = get_ghostscript_version().strip()
+    versions["imagemagick"] = get_imagemagick_version().strip()
+    return versions
+
+
+def cache_digest(*parts) -> str:
+    """
+    Hashes `parts` with BLAKE2b. Bytes and file-like objects are hashed as they are, in chunks, rather than being
+    converted to strings first. Each part is hashed on its own and the results are combined, so `("ab", "c")` and
+    `("a", "bc")` get different digests.
+    """
+    hasher = blake2b(digest_size=20)
+    for part in parts:
+        tag, part_hasher = _hash_part(part)
+        hasher.update(tag + part_hasher.digest())
+    return hasher.hexdigest()
+
+
+def _hash_part(part):
+    if isinstance(part, str):
+        return b"s", blake2b(part.encode("utf-8"))
+    if isinstance(part, bytes | bytearray | memoryview):
+        return b"b", blake2b(part)
+    if hasattr(part, "read"):
+        return b"b", _hash_file(part)
+    if part is None or isinstance(part, bool | int):
+        return b"v", blake2b(repr(part).encode("ascii"))
+    raise TypeError(f"Can't derive a cache key from {type(part).__name__}")
+
+
+def _hash_file(file, chunk_size=64 * 1024):
+    if hasattr(file, "getbuffer"):
+        # a BytesIO can be hashed without copying its contents
+        with file.getbuffer() as buffer:
+            return blake2b(buffer)
+
+    hasher = blake2b()
+    file.seek(0)
+    while chunk := file.read(chunk_size):
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher
+
+
+class CacheStats:
+    """
+    Rolling totals of the stats a process has sent to statsd, over the last `window_seconds`. Values are added to
+    buckets of `bucket_seconds`, so old values drop out a bucket at a time.
+    """
+
+    def __init__(self, window_seconds, bucket_seconds=10):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, stat, value):
+        bucket_start = int(time.monotonic() // self.bucket_seconds)
+        with self._lock:
+            bucket = self._buckets.setdefault(bucket_start, {})
+            count, total, maximum = bucket.get(stat, (0, 0, value))
+            bucket[stat] = count + 1, total + value, max(maximum, value)
+            self._expire()
+
+    def snapshot(self) -> dict:
+        """
+        Returns the count, total and maximum of each stat, and the ratio of hits to misses for each stat that has
+        them, e.g. `letter-cache.templated.png` or `letter-cache.memory`.
+        """
+        stats = {}
+        with self._lock:
+            self._expire()
+            for bucket in self._buckets.values():
+                for stat, (count, total, maximum) in bucket.items():
+                    totals = stats.setdefault(stat, {"count": 0, "total": 0, "max": maximum})
+                    totals["count"] += count
+                    totals["total"] += total
+                    totals["max"] = max(totals["max"], maximum)
+
+        hit_ratios = {}
+        for prefix in {stat.rsplit(".", 1)[0] for stat in stats if stat.endswith((".hit", ".miss"))}:
+            hits = stats.get(f"{prefix}.hit", {"count": 0})["count"]
+            misses = stats.get(f"{prefix}.miss", {"count": 0})["count"]
+            hit_ratios[prefix] = hits / (hits + misses)
+
+        return {"window_seconds": self.window_seconds, "stats": stats, "hit_ratios": hit_ratios}
+
+    def _expire(self):
+        oldest = int((time.monotonic() - self.window_seconds) // self.bucket_seconds)
+        while self._buckets and next(iter(self._buckets)) < oldest:
+            self._buckets.popitem(last=False)
+
+
+class WriteBehindUploader:
+    """
+    Uploads newly rendered objects to S3 from a background thread, so the request that rendered them doesn't have to
+    wait for the upload.
+
+    The queue is bounded. When it's full, callers block for up to `put_timeout` seconds to slow producers down, and
+    after that the upload is dropped - it's only a cache, so the worst case is rendering the letter again. Failed
+    uploads are retried with exponential backoff. Call `drain` on shutdown to finish any queued uploads.
+    """
+
+    def __init__(self, upload, application, max_queue_size, max_attempts=3, retry_delay=0.5, put_timeout=0.1):
+        self.upload = upload
+        self.application = application
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._thread_pid = None
+        self._thread_lock = threading.Lock()
+
+    def put(self, cache_key, data: bytes):
+        self._ensure_thread_is_running()
+
+        try:
+            self.queue.put((cache_key, data), timeout=self.put_timeout)
+        except queue.Full:
+            self.application.statsd_client.incr("letter-cache.write-behind.dropped")
+            self.application.logger.warning("Write-behind queue full, not caching %s", cache_key)
+
+        self.application.statsd_client.gauge("letter-cache.write-behind.queue-depth", self.queue.qsize())
+
+    def drain(self, timeout):
+        deadline = time.monotonic() + timeout
+
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.application.logger.warning(
+                        "Gave up draining write-behind queue with %s uploads left", self.queue.unfinished_tasks
+                    )
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+
+        return True
+
+    def _ensure_thread_is_running(self):
+        # threads don't survive a fork, so a worker forked after the thread started needs its own
+        with self._thread_lock:
+            if self._thread_pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-behind-uploader", daemon=True)
+                self._thread.start()
+                self._thread_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            cache_key, data = self.queue.get()
+            try:
+                self._upload_with_retries(cache_key, data)
+            finally:
+                self.queue.task_done()
+                self.application.statsd_client.gauge("letter-cache.write-behind.queue-depth", self.queue.qsize())
+
+    def _upload_with_retries(self, cache_key, data):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.upload(cache_key, data)
+                return
+            except Exception:
+                if attempt == self.max_attempts:
+                    self.application.statsd_client.incr("letter-cache.write-behind.failed")
+                    self.application.logger.exception("Failed to upload %s to the letter cache", cache_key)
+                    return
+
+                self.application.statsd_client.incr("letter-cache.write-behind.retried")
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+
+class SingleFlight:
+    """
+    Lets only one caller at a time render a given cache key, so that a burst of requests for the same letter doesn't
+    run WeasyPrint and ImageMagick once per request.
+
+    Threads in the same process wait on a lock per key. If `lock_path` is set, processes on the same host also wait
+    on an flock of a file per key. Keys never share a lock, so a caller can hold one key's lock while it fills
+    another, and whoever holds a lock removes its file when they're done, so lock files don't pile up.
+
+    Callers that had to wait are told so, so they can check the cache again before rendering. If the lock isn't
+    released within `timeout` seconds, the caller gives up waiting and goes ahead anyway.
+    """
+
+    def __init__(self, lock_path=None, timeout=20):
+        self.lock_path = lock_path
+        self.timeout = timeout
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+        if self.lock_path:
+            os.makedirs(self.lock_path, exist_ok=True)
+
+    @contextmanager
+    def __call__(self, key):
+        deadline = time.monotonic() + self.timeout
+
+        with self._thread_lock(key, deadline) as thread_waited:
+            if self.lock_path:
+                with self._file_lock(key, deadline) as process_waited:
+                    yield thread_waited or process_waited
+            else:
+                yield thread_waited
+
+    @contextmanager
+    def _thread_lock(self, key, deadline):
+        with self._locks_lock:
+            lock, waiters = self._locks.get(key, (threading.Lock(), 0))
+            self._locks[key] = lock, waiters + 1
+
+        waited = not lock.acquire(blocking=False)
+        acquired = not waited or lock.acquire(timeout=max(deadline - time.monotonic(), 0))
+
+        try:
+            yield waited
+        finally:
+            if acquired:
+                lock.release()
+            with self._locks_lock:
+                lock, waiters = self._locks[key]
+                if waiters == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = lock, waiters - 1
+
+    @contextmanager
+    def _file_lock(self, key, deadline):
+        path = os.path.join(self.lock_path, f"{blake2b(key.encode('utf-8'), digest_size=16).hexdigest()}.lock")
+
+        waited = False
+        while not (lock_file := self._lock_file(path)):
+            waited = True
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+
+        try:
+            yield waited
+        finally:
+            if lock_file:
+                os.unlink(path)
+                lock_file.close()
+
+    @staticmethod
+    def _lock_file(path):
+        lock_file = open(path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # whoever held the lock before us removes the file when they're done, maybe after we opened it, in which
+            # case our lock is on a file nobody else will look at
+            if os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino:
+                return lock_file
+        except (BlockingIOError, FileNotFoundError):
+            pass
+        lock_file.close()
+        return None
+
+
+class NegativeCache:
+    """
+    Remembers JSON results, like why a file failed validation, for `ttl` seconds. They're kept in memory, and on disk
+    if there's a disk tier so other workers on the host see them too. They're never uploaded to S3, because a miss
+    has to be cheap: most files are valid.
+    """
+
+    def __init__(self, ttl, disk_cache=None, max_bytes=1024 * 1024):
+        self.ttl = ttl
+        self.memory_cache = MemoryCache(max_bytes)
+        self.disk_cache = disk_cache
+
+    def get(self, key) -> dict | None:
+        data = self.memory_cache.get(key)
+        if data is None and self.disk_cache:
+            data = self.disk_cache.get(key)
+        if data is None:
+            return None
+
+        entry = json.loads(data)
+        if entry["expires_at"] < time.time():
+            return None
+
+        self.memory_cache.set(key, data)
+        return entry["result"]
+
+    def set(self, key, result: dict):
+        data = json.dumps({"expires_at": time.time() + self.ttl, "result": result}).encode("utf-8")
+        self.memory_cache.set(key, data)
+        if self.disk_cache:
+            self.disk_cache.set(key, data)
+
+
+class AssetCache:
+    """
+    Keeps the results of WeasyPrint URL fetches for `ttl` seconds, in memory and on disk if there's a disk tier. The
+    content is stored as it was fetched, after a line of JSON holding the rest of the result and when it expires.
+    Assets bigger than `max_bytes` aren't stored.
+    """
+
+    def __init__(self, ttl, disk_cache=None, max_bytes=8 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_cache = MemoryCache(max_bytes)
+        self.disk_cache = disk_cache
+
+    def get(self, key) -> dict | None:
+        data = self.memory_cache.get(key)
+        if data is None and self.disk_cache:
+            data = self.disk_cache.get(key)
+        if data is None:
+            return None
+
+        header, _, content = data.partition(b"\n")
+        entry = json.loads(header)
+        if entry.pop("expires_at") < time.time():
+            return None
+
+        self.memory_cache.set(key, data)
+        return {**entry, "string": content}
+
+    def set(self, key, result: dict):
+        content = result["string"]
+        if isinstance(content, str):
+            content = content.encode(result.get("encoding") or "utf-8")
+        if len(content) > self.max_bytes:
+            return
+
+        header = {name: value for name, value in result.items() if name != "string"}
+        data = json.dumps({**header, "expires_at": time.time() + self.ttl}).encode("utf-8") + b"\n" + content
+        self.memory_cache.set(key, data)
+        if self.disk_cache:
+            self.disk_cache.set(key, data)
+
+
+class MemoryCache:
+    """
+    A bounded, in-process LRU of raw bytes. Objects bigger than the whole cache are never stored, and the least
+    recently used entries are evicted once the total size goes over `max_bytes`.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> bytes | None:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= len(self._entries.pop(key))
+
+            self._entries[key] = data
+            self.current_bytes += len(data)
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+class DiskCache:
+    """
+    A bounded cache of files on local disk, shared by every worker process on the host.
+
+    Writes go to a temporary file which is then renamed into place, so readers in other processes never see a
+    partially written object. Every read touches the file's mtime, and when the directory grows past `max_bytes` the
+    least recently used files are deleted until it is back under `LOW_WATER_MARK` of the limit.
+    """
+
+    LOW_WATER_MARK = 0.9
+    TEMPORARY_FILE_PREFIX = ".tmp-"
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+        self.current_bytes = sum(entry.size for entry in self._scan())
+
+    def _path_for(self, key):
+        return os.path.join(self.path, *key.split("/"))
+
+    def _scan(self):
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.startswith(self.TEMPORARY_FILE_PREFIX):
+                    continue
+                # files can be evicted by another worker while we're walking the directory
+                with suppress(FileNotFoundError):
+                    yield _Entry(os.path.join(dirpath, filename))
+
+    def get(self, key) -> bytes | None:
+        if (f := self.open(key)) is None:
+            return None
+        with f:
+            return f.read()
+
+    def open(self, key) -> BinaryIO | None:
+        path = self._path_for(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        # if another worker evicts the file now, it stays readable through our open file handle
+        with suppress(FileNotFoundError):
+            os.utime(path)
+        return f
+
+    def set(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+
+        self.set_from_file(key, BytesIO(data)).close()
+
+    def set_from_file(self, key, source: BinaryIO) -> BinaryIO:
+        """
+        Copies `source` to disk in chunks and returns an open file containing it, rewound to the start. If it's too big
+        to cache the file is still returned, but deleted from the cache directory.
+        """
+        path = self._path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        f = NamedTemporaryFile(dir=os.path.dirname(path), prefix=self.TEMPORARY_FILE_PREFIX, delete=False)
+        copyfileobj(source, f)
+        size = f.tell()
+        f.seek(0)
+
+        if size > self.max_bytes:
+            os.remove(f.name)
+            return f
+
+        os.replace(f.name, path)
+
+        self.current_bytes += size
+        if self.current_bytes > self.max_bytes:
+            self.evict()
+
+        return f
+
+    def evict(self):
+        # other workers write to the same directory, so rescan it to find the real size before deleting anything
+        entries = sorted(self._scan(), key=lambda entry: entry.mtime)
+        self.current_bytes = sum(entry.size for entry in entries)
+
+        for entry in entries:
+            if self.current_bytes <= self.max_bytes * self.LOW_WATER_MARK:
+                break
+            with suppress(FileNotFoundError):
+                os.remove(entry.path)
+                self.current_bytes -= entry.size
+
+
+class _Entry:
+    def __init__(self, path):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
@@ -7,7 +7,6 @@ import sentry_sdk
 from botocore.exceptions import ClientError as BotoClientError
 from celery import Task
 from flask import current_app
-from flask_weasyprint import HTML
 from notifications_utils import LETTER_MAX_PAGE_COUNT
 from notifications_utils.s3 import s3download, s3upload
 from notifications_utils.template import LetterPrintTemplate
@@ -16,7 +15,9 @@ from app import notify_celery
 from app.config import QueueNames, TaskNames
 from app.precompiled import sanitise_file_contents
 from app.preview import get_page_count_for_pdf
-from app.templated import generate_templated_pdf
+from app.render_pool import HTML
+from app.templated import add_letter_attachment, generate_templated_pdf, render_templated_pdf
+from app.transformation import convert_pdfs_to_cmyk
 from app.utils import PDFPurpose
 from app.weasyprint_hack import WeasyprintError
 
@@ -112,9 +113,7 @@ def copy_s3_object(source_bucket, source_filename, target_bucket, target_filenam
     )
 
 
-def _create_pdf_for_letter(
-    task: Task, letter_details, language: Literal["english", "welsh"], include_notify_tag: bool = True
-):
+def _create_pdf_for_letter(letter_details, language: Literal["english", "welsh"], include_notify_tag: bool = True):
     logo_filename = f'{letter_details["logo_filename"]}.svg' if letter_details["logo_filename"] else None
     template = LetterPrintTemplate(
         letter_details["template"],
@@ -129,13 +128,8 @@ def _create_pdf_for_letter(
     with current_app.test_request_context(""):
         html = HTML(string=str(template))
 
-    try:
-        with sentry_sdk.start_span(op="function", description=f"weasyprint.HTML.write_pdf[{language}]"):
-            pdf = BytesIO(html.write_pdf())
-    except WeasyprintError as exc:
-        task.retry(exc=exc, queue=QueueNames.SANITISE_LETTERS)
-
-    return pdf
+    with sentry_sdk.start_span(op="function", description=f"weasyprint.HTML.write_pdf[{language}]"):
+        return BytesIO(html.write_pdf())
 
 
 @notify_celery.task(
@@ -149,7 +143,14 @@ def create_pdf_for_templated_letter(self: Task, encoded_letter_data):
     current_app.logger.info("Creating a pdf for notification with id %s", letter_details["notification_id"])
 
     cmyk_pdf = _prepare_pdf(letter_details, self)
+    _upload_letter_pdf(letter_details, cmyk_pdf)
 
+
+def _upload_letter_pdf(letter_details, cmyk_pdf) -> int | None:
+    """
+    Uploads a letter's PDF to the bucket for its key type, or to the invalid bucket if it's too long, and tells the API
+    how many pages it has. Returns the page count, or None if the upload failed.
+    """
     page_count = get_page_count_for_pdf(cmyk_pdf.read())
     cmyk_pdf.seek(0)
     try:
@@ -193,7 +194,7 @@ def create_pdf_for_templated_letter(self: Task, encoded_letter_data):
             "Error uploading %(filename)s to pdf bucket for notification %(id)s",
             {"filename": letter_details["letter_filename"], "id": letter_details["notification_id"]},
         )
-        return
+        return None
 
     notify_celery.send_task(
         name=task_name,
@@ -203,15 +204,77 @@ def create_pdf_for_templated_letter(self: Task, encoded_letter_data):
         },
         queue=QueueNames.LETTERS,
     )
+    return page_count
 
 
 def _prepare_pdf(letter_details, self):
-    def create_pdf_for_letter(letter_details, language, include_tag) -> BytesIO:
-        return _create_pdf_for_letter(self, letter_details, language=language, include_notify_tag=include_tag)
-
     purpose = PDFPurpose.PRINT
 
-    return generate_templated_pdf(letter_details, create_pdf_for_letter, purpose)
+    # languages can be rendered in other threads, where `retry` wouldn't know which task to retry, so it's done here
+    try:
+        return generate_templated_pdf(letter_details, _create_pdf_for_letter_in_language, purpose)
+    except WeasyprintError as exc:
+        self.retry(exc=exc, queue=QueueNames.SANITISE_LETTERS)
+
+
+def _create_pdf_for_letter_in_language(letter_details, language, include_tag) -> BytesIO:
+    return _create_pdf_for_letter(letter_details, language=language, include_notify_tag=include_tag)
+
+
+@notify_celery.task(
+    bind=True,
+    name="create-pdfs-for-templated-letters",
+    max_retries=3,
+    default_retry_delay=180,
+)
+def create_pdfs_for_templated_letters(self: Task, encoded_batch_data):
+    """
+    Like `create-pdf-for-templated-letter`, for many letters from the same template. The batch has the same keys as the
+    data for one letter, except that each letter's `notification_id`, `letter_filename` and `values` are in a list of
+    `letters`. Returns each letter's page count by notification id, or None for letters that couldn't be uploaded.
+    """
+    batch_details = current_app.signing_client.decode(encoded_batch_data)
+    current_app.logger.info(
+        "Creating pdfs for %s letters from template %s", len(batch_details["letters"]), batch_details["template"]["id"]
+    )
+
+    page_counts = {}
+    try:
+        for notification_id, page_count in _create_pdfs_for_templated_letters(batch_details):
+            page_counts[notification_id] = page_count
+    except WeasyprintError as exc:
+        # letters that have already been uploaded aren't rendered again
+        remaining_letters = [
+            letter for letter in batch_details["letters"] if letter["notification_id"] not in page_counts
+        ]
+        self.retry(
+            args=(current_app.signing_client.encode({**batch_details, "letters": remaining_letters}),),
+            exc=exc,
+            queue=QueueNames.SANITISE_LETTERS,
+        )
+
+    return page_counts
+
+
+def _create_pdfs_for_templated_letters(batch_details):
+    """
+    Renders, converts and uploads each letter in the batch like `create_pdf_for_templated_letter` does, yielding its
+    notification id and page count as soon as it's uploaded.
+
+    Every letter shares the worker's parsed stylesheets, fonts and cached logo. Letters are converted to CMYK by one
+    Ghostscript process for every `TEMPLATED_LETTER_BATCH_CHUNK_SIZE` letters, rather than one each.
+    """
+    template_details = {key: value for key, value in batch_details.items() if key != "letters"}
+    letters = [{**template_details, **letter} for letter in batch_details["letters"]]
+    chunk_size = current_app.config["TEMPLATED_LETTER_BATCH_CHUNK_SIZE"]
+
+    for start in range(0, len(letters), chunk_size):
+        chunk = letters[start : start + chunk_size]
+        pdfs = [render_templated_pdf(letter_details, _create_pdf_for_letter_in_language) for letter_details in chunk]
+
+        for letter_details, cmyk_pdf in zip(chunk, convert_pdfs_to_cmyk(pdfs), strict=True):
+            pdf = add_letter_attachment(letter_details, cmyk_pdf)
+            yield letter_details["notification_id"], _upload_letter_pdf(letter_details, pdf)
 
 
 def _remove_folder_from_filename(filename):
@@ -0,0 +1,125 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import jsonschema
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app import create_app
+from app.preview import get_attachment_png, get_page_count_for_pdf, get_pngs, prepare_pdf
+from app.render_pool import RenderPool
+from app.schemas import preview_schema
+from app.utils import ensure_seekable
+
+
+def setup_commands(application):
+    application.cli.add_command(prewarm_cache)
+    application.cli.add_command(run_render_pool)
+
+
+@click.command("prewarm-cache")
+@click.argument("payloads", type=click.File())
+@click.option(
+    "--concurrency",
+    default=os.cpu_count(),
+    show_default=True,
+    help="Number of processes to render letters in",
+)
+@with_appcontext
+def prewarm_cache(payloads, concurrency):
+    """
+    Render the preview PDF and every page PNG for each letter in PAYLOADS, so they're in the letter cache before anyone
+    asks for them. PAYLOADS is a file with one /preview.png request body per line.
+    """
+    letters = list(_read_payloads(payloads))
+    if not letters:
+        raise click.ClickException("No letters to pre-warm")
+
+    start = time.monotonic()
+    if concurrency > 1:
+        with ProcessPoolExecutor(max_workers=concurrency, initializer=_init_worker) as executor:
+            results = list(executor.map(_prewarm_or_report, letters))
+    else:
+        results = [_prewarm_or_report(letter) for letter in letters]
+    elapsed = time.monotonic() - start
+
+    pages = sum(page_count for page_count in results if page_count is not None)
+    failed = results.count(None)
+    click.echo(
+        f"Pre-warmed {len(results) - failed} letters ({pages} pages) in {elapsed:.1f}s: "
+        f"{len(results) / elapsed:.2f} letters/s, {pages / elapsed:.2f} pages/s. {failed} failed."
+    )
+
+
+def _read_payloads(payloads):
+    for line_number, line in enumerate(payloads, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            payload = json.loads(line)
+            jsonschema.validate(payload, preview_schema)
+        except (json.JSONDecodeError, jsonschema.ValidationError) as e:
+            click.echo(f"Skipping line {line_number}: {e}", err=True)
+            continue
+
+        yield line_number, payload
+
+
+def _init_worker():
+    create_app().app_context().push()
+
+
+def _prewarm_or_report(letter):
+    line_number, payload = letter
+    try:
+        return prewarm_letter(payload)
+    except Exception as e:
+        current_app.logger.exception("Failed to pre-warm letter on line %s", line_number)
+        click.echo(f"Failed to pre-warm line {line_number}: {e!r}", err=True)
+        return None
+
+
+def prewarm_letter(payload):
+    """
+    Renders a letter through the same cached functions as /preview.pdf, /preview.png and
+    /letter_attachment_preview.png, and returns how many pages it has.
+    """
+    # WeasyPrint resolves the letter's URLs against a request, like it does in the celery tasks
+    with current_app.test_request_context(""):
+        pdf = ensure_seekable(prepare_pdf(payload))
+    page_count = get_page_count_for_pdf(pdf)
+    pdf.seek(0)
+    get_pngs(pdf, range(1, page_count + 1))
+
+    if letter_attachment := payload["template"].get("letter_attachment"):
+        # attachments are cached by service, which preview_schema doesn't require
+        if not (service_id := payload["template"].get("service")):
+            click.echo(f"Not pre-warming attachment {letter_attachment['id']}: its template has no service", err=True)
+            return page_count
+
+        for page_number in range(1, letter_attachment["page_count"] + 1):
+            get_attachment_png(service_id, letter_attachment["id"], page_number)
+
+    return page_count
+
+
+@click.command("run-render-pool")
+@with_appcontext
+def run_render_pool():
+    """
+    Run a pool of warm processes that render letters to PDF for web and celery workers with RENDER_POOL_SOCKET_PATH
+    set to the same socket.
+    """
+    if not current_app.config["RENDER_POOL_SOCKET_PATH"]:
+        raise click.ClickException("RENDER_POOL_SOCKET_PATH isn't set")
+
+    RenderPool(
+        current_app._get_current_object(),
+        current_app.config["RENDER_POOL_SOCKET_PATH"],
+        processes=current_app.config["RENDER_POOL_PROCESSES"],
+        max_rss_bytes=current_app.config["RENDER_POOL_MAX_RSS_BYTES"],
+    ).serve_forever()
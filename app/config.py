@@ -65,6 +65,60 @@ class Config:
     LETTER_ATTACHMENT_BUCKET_NAME = os.environ.get("LETTER_ATTACHMENT_BUCKET_NAME")
     LETTER_LOGO_URL = os.environ.get("LETTER_LOGO_URL")
 
+    # local tiers in front of the S3 letter cache. Set the memory limit to 0, or leave the disk path unset, to disable
+    LETTER_CACHE_MEMORY_MAX_BYTES = int(os.environ.get("LETTER_CACHE_MEMORY_MAX_BYTES", 32 * 1024 * 1024))
+    LETTER_CACHE_DISK_PATH = os.environ.get("LETTER_CACHE_DISK_PATH")
+    LETTER_CACHE_DISK_MAX_BYTES = int(os.environ.get("LETTER_CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024))
+    # concurrent misses for the same key wait for a single render. Set a lock path to coalesce across processes too
+    LETTER_CACHE_LOCK_PATH = os.environ.get("LETTER_CACHE_LOCK_PATH")
+    LETTER_CACHE_LOCK_TIMEOUT_SECONDS = int(os.environ.get("LETTER_CACHE_LOCK_TIMEOUT_SECONDS", 20))
+    # upload newly rendered objects to S3 in the background rather than before responding
+    LETTER_CACHE_WRITE_BEHIND = bool(int(os.environ.get("LETTER_CACHE_WRITE_BEHIND", "0")))
+    LETTER_CACHE_WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get("LETTER_CACHE_WRITE_BEHIND_QUEUE_SIZE", 50))
+    LETTER_CACHE_WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get("LETTER_CACHE_WRITE_BEHIND_MAX_ATTEMPTS", 3))
+    LETTER_CACHE_WRITE_BEHIND_DRAIN_TIMEOUT_SECONDS = int(
+        os.environ.get("LETTER_CACHE_WRITE_BEHIND_DRAIN_TIMEOUT_SECONDS", 10)
+    )
+    # keys are namespaced by renderer versions and LETTER_CACHE_VERSION, unless LETTER_CACHE_NAMESPACE is set. After
+    # an upgrade, set the previous namespace (see /_status) and raise the migration rate from 0 to 1 to re-render slowly
+    LETTER_CACHE_VERSION = os.environ.get("LETTER_CACHE_VERSION", "1")
+    LETTER_CACHE_NAMESPACE = os.environ.get("LETTER_CACHE_NAMESPACE")
+    LETTER_CACHE_PREVIOUS_NAMESPACE = os.environ.get("LETTER_CACHE_PREVIOUS_NAMESPACE")
+    LETTER_CACHE_MIGRATION_RATE = float(os.environ.get("LETTER_CACHE_MIGRATION_RATE", 1))
+    # how long to remember that a precompiled letter is invalid, so repeat submissions fail fast. Set to 0 to disable
+    LETTER_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get("LETTER_CACHE_NEGATIVE_TTL_SECONDS", 60 * 60))
+    # how far back the per-worker stats at /_status/cache go
+    LETTER_CACHE_STATS_WINDOW_SECONDS = int(os.environ.get("LETTER_CACHE_STATS_WINDOW_SECONDS", 5 * 60))
+    # logos and other assets WeasyPrint fetches over HTTP are kept in memory and on disk, and fetched again after the
+    # TTL. Set the TTL to 0 to fetch them for every render
+    LETTER_ASSET_CACHE_TTL_SECONDS = int(os.environ.get("LETTER_ASSET_CACHE_TTL_SECONDS", 60 * 60))
+    LETTER_ASSET_CACHE_MAX_BYTES = int(os.environ.get("LETTER_ASSET_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+
+    # if set, letters are rendered to PDF by the pool run with `flask run-render-pool`, listening on this socket,
+    # rather than in the web or celery worker. Its workers are replaced once their peak RSS passes the maximum
+    RENDER_POOL_SOCKET_PATH = os.environ.get("RENDER_POOL_SOCKET_PATH")
+    RENDER_POOL_PROCESSES = int(os.environ.get("RENDER_POOL_PROCESSES", 4))
+    RENDER_POOL_MAX_RSS_BYTES = int(os.environ.get("RENDER_POOL_MAX_RSS_BYTES", 512 * 1024 * 1024))
+    RENDER_POOL_TIMEOUT_SECONDS = int(os.environ.get("RENDER_POOL_TIMEOUT_SECONDS", 60))
+    # with a render pool, the Welsh and English halves of bilingual letters are rendered at the same time
+    RENDER_LANGUAGES_IN_PARALLEL = bool(int(os.environ.get("RENDER_LANGUAGES_IN_PARALLEL", "1")))
+    # letters in a create-pdfs-for-templated-letters batch are converted to CMYK by one Ghostscript process this many
+    # at a time, and uploaded as soon as they're converted
+    TEMPLATED_LETTER_BATCH_CHUNK_SIZE = int(os.environ.get("TEMPLATED_LETTER_BATCH_CHUNK_SIZE", 50))
+
+    # "wand" rasterises preview PNGs with ImageMagick and Ghostscript, "pymupdf" with MuPDF in process
+    PREVIEW_RASTERISER = os.environ.get("PREVIEW_RASTERISER", "wand")
+    # zlib level for preview PNGs, from 0 (not compressed, fastest) to 9 (smallest), and the PNG filter from 0 (none) to
+    # 5 (adaptive). Leave them unset for the encoder's defaults. PNGs made with other settings are cached under other
+    # keys. Callers can ask for PNGs that aren't compressed at all with `compression=none`, which aren't cached. See
+    # scripts/benchmark_png_compression.py
+    PREVIEW_PNG_COMPRESSION_LEVEL = (
+        int(os.environ["PREVIEW_PNG_COMPRESSION_LEVEL"]) if os.environ.get("PREVIEW_PNG_COMPRESSION_LEVEL") else None
+    )
+    PREVIEW_PNG_COMPRESSION_FILTER = (
+        int(os.environ["PREVIEW_PNG_COMPRESSION_FILTER"]) if os.environ.get("PREVIEW_PNG_COMPRESSION_FILTER") else None
+    )
+
 
 class Development(Config):
     SERVER_NAME = os.getenv("SERVER_NAME")
@@ -96,6 +150,15 @@ class Test(Development):
     PRECOMPILED_ORIGINALS_BACKUP_LETTER_BUCKET_NAME = "test-letters-precompiled-originals-backup"
     LETTER_ATTACHMENT_BUCKET_NAME = "test-letter-attachments"
 
+    # tests make assertions about calls to S3, so don't let earlier tests serve them from a local cache
+    LETTER_CACHE_MEMORY_MAX_BYTES = 0
+    LETTER_CACHE_DISK_PATH = None
+    LETTER_CACHE_WRITE_BEHIND = False
+    LETTER_CACHE_NEGATIVE_TTL_SECONDS = 0
+    LETTER_ASSET_CACHE_TTL_SECONDS = 0
+    # don't shell out for gs and ImageMagick versions to build the namespace
+    LETTER_CACHE_NAMESPACE = "test"
+
 
 configs = {
     "development": Development,
@@ -5,7 +5,7 @@ from botocore.response import StreamingBody
 from flask import current_app
 from notifications_utils.s3 import s3download
 
-from app.utils import stitch_pdfs
+from app.utils import ensure_seekable, stitch_pdfs
 
 
 @sentry_sdk.trace
@@ -19,10 +19,9 @@ def get_attachment_pdf(service_id, attachment_id) -> bytes:
 def add_attachment_to_letter(service_id, templated_letter_pdf: StreamingBody, attachment_object: dict) -> BytesIO:
     attachment_pdf = get_attachment_pdf(service_id, attachment_object["id"])
 
-    # templated letters are cached in s3, where a StreamingBody is returned which does not have a seek function,
-    # so we need to read the `bytes` and then wrap that in a `BytesIO` as a buffer
+    # templated letters might be a StreamingBody straight from s3, which does not have a seek function
     stitched_pdf = stitch_pdfs(
-        first_pdf=BytesIO(templated_letter_pdf.read()),
+        first_pdf=ensure_seekable(templated_letter_pdf),
         second_pdf=BytesIO(attachment_pdf),
     )
 
@@ -1,6 +1,7 @@
 import base64
 import math
 import unicodedata
+from functools import cache
 from io import BytesIO
 from itertools import groupby
 from operator import itemgetter
@@ -21,8 +22,9 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
 from app import InvalidRequest, ValidationFailed, auth
+from app.cache import cache_digest
 from app.embedded_fonts import contains_unembedded_fonts, embed_fonts
-from app.preview import png_from_pdf
+from app.preview import png_from_pdf, pngs_from_pdf
 from app.transformation import (
     convert_pdf_to_cmyk,
     does_pdf_contain_cmyk,
@@ -189,7 +191,16 @@ def sanitise_file_contents(encoded_string, *, allow_international_letters, filen
     * makes sure letter meets DVLA's printable boundaries and page dimensions requirements
     * re-writes address block (to ensure it's in arial in the right location)
     * adds NOTIFY tag if not present
+
+    Validation failures are remembered for a while, so retrying the same file doesn't parse it all over again.
     """
+    failure_cache_args = (encoded_string, allow_international_letters, is_an_attachment)
+    if (failure := current_app.cache.get_failure(*failure_cache_args, folder="sanitise")) is not None:
+        current_app.logger.warning(
+            "Validation failed for precompiled pdf: %s (cached) for file name: %s", failure["message"], filename
+        )
+        return failure
+
     try:
         file_data = BytesIO(encoded_string)
 
@@ -229,13 +240,15 @@ def sanitise_file_contents(encoded_string, *, allow_international_letters, filen
             exc_info=True,
         )
 
-        return {
+        failure = {
             "page_count": getattr(error, "page_count", None),
             "recipient_address": None,
             "message": getattr(error, "message", "unable-to-read-the-file"),
             "invalid_pages": getattr(error, "invalid_pages", None),
             "file": None,
         }
+        current_app.cache.set_failure(failure, *failure_cache_args, folder="sanitise")
+        return failure
     # Anything else is probably a bug but usually infrequent, so pretend it's invalid.
     except Exception as error:
         current_app.logger.exception(
@@ -328,6 +341,71 @@ def overlay_template_png_for_page():
     )
 
 
+@precompiled_blueprint.route("/precompiled/overlay-pages.json", methods=["POST"])
+@auth.login_required
+def overlay_template_pngs():
+    """
+    Returns pngs of every page of the PDF in the POST body with the red overlay applied, so the admin app can get them
+    all in one call rather than calling overlay.png for each page. Pages are base64 encoded:
+    {
+        "page_count": 2,
+        "pages": {"1": "...", "2": "..."}
+    }
+
+    Like overlay.png, pass "is_an_attachment=true" to leave the address block off the first page.
+    """
+    encoded_string = request.get_data()
+
+    if not encoded_string:
+        raise InvalidRequest("no data received in POST")
+
+    is_an_attachment = request.args.get("is_an_attachment", "").lower() == "true"
+
+    try:
+        pdf = PdfReader(BytesIO(encoded_string))
+        page_count = len(pdf.pages)
+    except PdfReadError as e:
+        raise InvalidRequest(f"Unable to read the PDF data: {e}") from e
+
+    extensions = {f"page{page_number:02d}.png": page_number for page_number in range(1, page_count + 1)}
+    pngs = current_app.cache.get_or_create_many(
+        "overlay",
+        cache_digest(encoded_string, is_an_attachment),
+        list(extensions),
+        lambda missing_extensions: _colour_no_print_areas_of_pages_in_red(
+            pdf,
+            [extensions[extension] for extension in missing_extensions],
+            is_an_attachment=is_an_attachment,
+        ),
+    )
+
+    return jsonify(
+        page_count=page_count,
+        pages={
+            str(page_number): base64.b64encode(pngs[extension].read()).decode("ascii")
+            for extension, page_number in extensions.items()
+        },
+    )
+
+
+def _colour_no_print_areas_of_pages_in_red(pdf, page_numbers, *, is_an_attachment):
+    """
+    Overlays the non-printable areas onto the given pages, and returns a png of each of them. All the pages are
+    rasterised in one go, rather than one page at a time like overlay.png.
+
+    :param PdfReader pdf: The whole letter. Note: the pages are modified by this function.
+    :param list page_numbers: One-indexed page numbers to colour and return pngs for.
+    :param bool is_an_attachment: true if the first page doesn't need the address block overlaid.
+    """
+    for page_number in page_numbers:
+        _colour_no_print_areas_of_page_in_red(
+            pdf.pages[page_number - 1],
+            is_first_page=(page_number == 1 and not is_an_attachment),
+        )
+
+    return pngs_from_pdf(bytesio_from_pdf(pdf), page_numbers)
+
+
 @precompiled_blueprint.route("/precompiled/overlay.pdf", methods=["POST"])
 @auth.login_required
 def overlay_template_pdf():
@@ -586,6 +664,16 @@ def _colour_no_print_areas_of_page_in_red(page, is_first_page):
     :param bool is_first_page: true if we should overlay the address block red area too.
     :return: None. It modifies the page object instead
     """
+    # the overlay is the same for every page apart from the first, so it's only drawn once for each
+    new_pdf = PdfReader(BytesIO(_no_print_areas_in_red(is_first_page)))
+
+    # note that the original page object is modified. I don't know if the original underlying src_pdf buffer is affected
+    # but i assume not.
+    page.merge_page(new_pdf.pages[0])
+
+
+@cache
+def _no_print_areas_in_red(is_first_page) -> bytes:
     red_transparent = Color(100, 0, 0, alpha=0.2)
 
     # Overlay the areas where the service can't print as per the template
@@ -631,12 +719,7 @@ def _colour_no_print_areas_of_page_in_red(page, is_first_page):
         pt2 = ADDRESS_RIGHT_FROM_LEFT_OF_PAGE, BODY_TOP_FROM_TOP_OF_PAGE
         can.rect(pt1, pt2)
 
-    # move to the beginning of the StringIO buffer
-    new_pdf = PdfReader(can.get_bytes())
-
-    # note that the original page object is modified. I don't know if the original underlying src_pdf buffer is affected
-    # but i assume not.
-    page.merge_page(new_pdf.pages[0])
+    return can.get_bytes().getvalue()
 
 
 def _get_out_of_bounds_pages(src_pdf_bytes):
@@ -1,72 +1,243 @@
 import base64
+import math
+from datetime import date
 from io import BytesIO
 
 import dateutil.parser
+import fitz
 import sentry_sdk
 from flask import Blueprint, abort, current_app, jsonify, request, send_file
-from flask_weasyprint import HTML
 from notifications_utils.template import (
     LetterPreviewTemplate,
 )
 from wand.color import Color
+from wand.drawing import Drawing
 from wand.exceptions import MissingDelegateError
 from wand.image import Image
 
 from app import auth
+from app.cache import cache_digest
 from app.letter_attachments import get_attachment_pdf
+from app.render_pool import HTML
 from app.schemas import get_and_validate_json_from_request, letter_attachment_preview_schema, preview_schema
-from app.templated import generate_templated_pdf
-from app.utils import PDFPurpose
+from app.templated import generate_templated_pdf, render_languages
+from app.utils import PDFPurpose, ensure_seekable
 
 preview_blueprint = Blueprint("preview_blueprint", __name__)
 
+PREVIEW_DPI = 150
+MIN_PREVIEW_DPI = 10
+A4_WIDTH_IN_INCHES = 210 / 25.4
+IMAGE_FORMATS = ("png", "webp")
+# PNGs are compressed with the PREVIEW_PNG_COMPRESSION_* settings, unless callers on the same network ask for them not
+# to be compressed at all
+PNG_COMPRESSIONS = ("default", "none")
+# WebP previews are lossless. Method 0 barely compresses letters, but 1 makes text pages about a third the size of a
+# PNG in about the same time
+WEBP_METHOD = 1
+
 
 # When the background is set to white traces of the Notify tag are visible in the preview png
 # As modifying the pdf text is complicated, a quick solution is to place a white block over it
-def hide_notify_tag(image):
-    with Image(width=130, height=50, background=Color("white")) as cover:
-        if image.colorspace == "cmyk":
-            cover.transform_colorspace("cmyk")
-        image.composite(cover, left=0, top=0)
+def hide_notify_tag(image, dpi=PREVIEW_DPI):
+    width, height = notify_tag_cover_size(dpi)
+    with Drawing() as draw:
+        draw.fill_color = Color("white")
+        draw.rectangle(left=0, top=0, right=width - 1, bottom=height - 1)
+        draw(image)
+
+
+def notify_tag_cover_size(dpi):
+    # 130 by 50 pixels at the default resolution
+    return round(130 * dpi / PREVIEW_DPI), round(50 * dpi / PREVIEW_DPI)
+
+
+def png_from_pdf(data, page_number, hide_notify=False, dpi=PREVIEW_DPI, image_format="png", compression="default"):
+    return pngs_from_pdf(
+        data, [page_number], hide_notify=hide_notify, dpi=dpi, image_format=image_format, compression=compression
+    )[0]
 
 
 @sentry_sdk.trace
-def png_from_pdf(data, page_number, hide_notify=False):
-    with Image(blob=data, resolution=150) as pdf:
-        pdf_width, pdf_height = pdf.width, pdf.height
-        try:
-            page = pdf.sequence[page_number - 1]
-        except IndexError:
-            abort(400, f"Letter does not have a page {page_number}")
-        pdf_colorspace = pdf.colorspace
-    return _generate_png_page(page, pdf_width, pdf_height, pdf_colorspace, hide_notify)
+def pngs_from_pdf(
+    data, page_numbers, hide_notify=False, dpi=PREVIEW_DPI, image_format="png", compression="default"
+) -> list[BytesIO]:
+    """
+    Rasterises the given pages of a PDF in one session, and returns an image of each, in the same order. They're PNGs
+    unless `image_format` is one of the other `IMAGE_FORMATS`, compressed as `compression` says. The
+    `PREVIEW_RASTERISER` config picks which library does it.
+    """
+    if hasattr(data, "read"):
+        data = data.read()
+
+    return RASTERISERS[current_app.config["PREVIEW_RASTERISER"]](
+        data, page_numbers, hide_notify, dpi, image_format, compression
+    )
+
+
+def _pngs_from_pdf_with_wand(
+    data: bytes, page_numbers, hide_notify=False, dpi=PREVIEW_DPI, image_format="png", compression="default"
+) -> list[BytesIO]:
+    # ImageMagick rasterises every page of a PDF it opens, so only give it the pages we want
+    try:
+        extracted = extract_pages(data, page_numbers)
+        sizes = page_sizes(data, page_numbers, dpi)
+        data, frames = extracted, range(len(page_numbers))
+    except IndexError as e:
+        abort(400, str(e))
+    except Exception:
+        current_app.logger.warning("Couldn't extract pages %s, rasterising the whole PDF", page_numbers, exc_info=True)
+        frames, sizes = [page_number - 1 for page_number in page_numbers], None
+
+    with Image(blob=data, resolution=dpi) as pdf:
+        # the whole PDF's first frame is page 1
+        sizes = sizes or [(pdf.width, pdf.height)] * len(page_numbers)
+        pngs = []
+        for page_number, frame, size in zip(page_numbers, frames, sizes, strict=True):
+            try:
+                page = pdf.sequence[frame]
+            except IndexError:
+                abort(400, f"Letter does not have a page {page_number}")
+            width, height = size or (page.width, page.height)
+            pngs.append(_generate_png_page(page, width, height, hide_notify, dpi, image_format, compression))
+        return pngs
+
+
+def _pngs_from_pdf_with_pymupdf(
+    data: bytes, page_numbers, hide_notify=False, dpi=PREVIEW_DPI, image_format="png", compression="default"
+) -> list[BytesIO]:
+    # MuPDF renders in process, rather than ImageMagick shelling out to Ghostscript and reading its output back
+    try:
+        document = fitz.open(stream=data, filetype="pdf")
+    except Exception:
+        current_app.logger.warning("Couldn't open PDF, rasterising it with ImageMagick", exc_info=True)
+        return _pngs_from_pdf_with_wand(data, page_numbers, hide_notify, dpi, image_format, compression)
+
+    with document:
+        pngs = []
+        for page_number in page_numbers:
+            if not 1 <= page_number <= document.page_count:
+                abort(400, f"Letter does not have a page {page_number}")
+            pixmap = document[page_number - 1].get_pixmap(dpi=dpi, alpha=False)
+            if hide_notify:
+                # the same white block as hide_notify_tag
+                pixmap.set_rect(fitz.IRect((0, 0), notify_tag_cover_size(dpi)), (255, 255, 255))
+            if image_format == "webp":
+                pngs.append(BytesIO(pixmap.pil_tobytes(format="WEBP", lossless=True, method=WEBP_METHOD)))
+            elif (level := _png_compression_level(compression)) is not None:
+                # MuPDF's own encoder can't be tuned, so go through Pillow. It has no choice of filter
+                pngs.append(BytesIO(pixmap.pil_tobytes(format="PNG", compress_level=level)))
+            else:
+                pngs.append(BytesIO(pixmap.tobytes("png")))
+        return pngs
+
+
+RASTERISERS = {
+    "wand": _pngs_from_pdf_with_wand,
+    "pymupdf": _pngs_from_pdf_with_pymupdf,
+}
+
+
+def extract_pages(pdf: bytes, page_numbers) -> bytes:
+    """
+    Returns a copy of the PDF with only the given pages in its page tree, in the given order. The other pages' objects
+    are left in the file, so ImageMagick picks the same colourspace for it as it would for the whole document.
+    """
+    with fitz.open(stream=pdf, filetype="pdf") as document:
+        for page_number in page_numbers:
+            if not 1 <= page_number <= document.page_count:
+                raise IndexError(f"Letter does not have a page {page_number}")
+        document.select([page_number - 1 for page_number in page_numbers])
+        return document.tobytes()
+
+
+def page_sizes(pdf: bytes, page_numbers, dpi=PREVIEW_DPI) -> list[tuple[int, int] | None]:
+    """
+    Pages that are a different size to page 1 are cropped or padded to match it. Returns the size in pixels to make
+    each of the given pages, or None for pages that are already the same size as page 1. Sizes come from the page
+    tree, so they don't depend on which pages are rasterised together.
+    """
+    with fitz.open(stream=pdf, filetype="pdf") as document:
+        first_page = document[0].rect
+        # rounded like ImageMagick sizes the image it asks Ghostscript for
+        first_page_pixels = (
+            math.ceil(first_page.width * dpi / 72 - 0.5),
+            math.ceil(first_page.height * dpi / 72 - 0.5),
+        )
+        return [
+            None if document[page_number - 1].rect == first_page else first_page_pixels for page_number in page_numbers
+        ]
 
 
-def _generate_png_page(pdf_page, pdf_width, pdf_height, pdf_colorspace, hide_notify=False):
+def _generate_png_page(
+    pdf_page, pdf_width, pdf_height, hide_notify=False, dpi=PREVIEW_DPI, image_format="png", compression="default"
+):
     output = BytesIO()
-    with Image(width=pdf_width, height=pdf_height) as image:
-        if pdf_colorspace == "cmyk":
-            image.transform_colorspace("cmyk")
+    with Image(image=pdf_page) as image:
+        # PNGs are sRGB, so CMYK pages are converted once here rather than when they're saved
+        if image.colorspace == "cmyk":
+            image.transform_colorspace("srgb")
+
+        # pages that are a different size to the first are cropped or padded to match it
+        if (image.width, image.height) != (pdf_width, pdf_height):
+            image.background_color = Color("transparent")
+            image.extent(width=pdf_width, height=pdf_height)
 
-        image.composite(pdf_page, top=0, left=0)
         if hide_notify:
-            hide_notify_tag(image)
-        with image.convert("png") as converted:
-            converted.save(file=output)
+            hide_notify_tag(image, dpi)
+        image.format = image_format
+        if image_format == "webp":
+            image.options["webp:lossless"] = "true"
+            image.options["webp:method"] = str(WEBP_METHOD)
+        else:
+            image.options.update(_png_compression_options(compression))
+        image.save(file=output)
     output.seek(0)
     return output
 
 
+def _png_compression_level(compression="default"):
+    if compression == "none":
+        return 0
+    return current_app.config["PREVIEW_PNG_COMPRESSION_LEVEL"]
+
+
+def _png_compression_options(compression="default"):
+    options = {}
+    if (level := _png_compression_level(compression)) is not None:
+        options["png:compression-level"] = str(level)
+    if compression == "default" and (png_filter := current_app.config["PREVIEW_PNG_COMPRESSION_FILTER"]) is not None:
+        options["png:compression-filter"] = str(png_filter)
+    return options
+
+
 @sentry_sdk.trace
 def get_page_count_for_pdf(pdf_data):
+    if hasattr(pdf_data, "read"):
+        pdf_data = pdf_data.read()
+
+    # reading the page tree is enough to count pages, rather than rasterising every page with ImageMagick
+    try:
+        with fitz.open(stream=pdf_data, filetype="pdf") as document:
+            return document.page_count
+    except Exception:
+        current_app.logger.warning("Couldn't read page tree, counting pages by rasterising the PDF", exc_info=True)
+
     with Image(blob=pdf_data) as image:
         return len(image.sequence)
 
 
 def _preview_and_get_page_count(letter_json, language="english"):
-    pdf = _get_pdf_from_letter_json(letter_json, language=language)
+    html = get_html(letter_json, language=language)
 
-    return get_page_count_for_pdf(pdf.read())
+    # page counts are cached next to the PDF, so repeat calls don't have to download or decode the PDF to count pages.
+    # Rendering the PDF is coalesced by `get_pdf`, so this doesn't hold a lock of its own while it waits for that
+    @current_app.cache(html, folder="templated", extension="page-count", coalesce=False)
+    def _get():
+        pdf = get_pdf(html)
+        return BytesIO(str(get_page_count_for_pdf(pdf.read())).encode("ascii"))
+
+    return int(_get().read())
 
 
 @preview_blueprint.route("/preview.json", methods=["POST"])
@@ -86,9 +257,13 @@ def page_count():
         counts["attachment_page_count"] = json["template"]["letter_attachment"]["page_count"]
 
     if json["template"].get("letter_languages", None) == "welsh_then_english":
-        counts["welsh_page_count"] = _preview_and_get_page_count(json, language="welsh")
+        counts["welsh_page_count"], english_pages_count = render_languages(
+            lambda: _preview_and_get_page_count(json, language="welsh"),
+            lambda: _preview_and_get_page_count(json),
+        )
+    else:
+        english_pages_count = _preview_and_get_page_count(json)
 
-    english_pages_count = _preview_and_get_page_count(json)
     counts["count"] = english_pages_count + counts["welsh_page_count"] + counts["attachment_page_count"]
 
     return jsonify(counts)
@@ -98,10 +273,59 @@ def page_count():
 @auth.login_required
 def view_letter_template_png():
     json = get_and_validate_json_from_request(request, preview_schema)
-    pdf = prepare_pdf(json)
-    # get pdf that can be read multiple times - unlike StreamingBody from boto that can only be read once
+    image_options = get_image_options_from_request()
     requested_page = int(request.args.get("page", 1))
-    return get_png_preview_for_pdf(pdf, page_number=requested_page)
+
+    etag = get_preview_etag(json, "png", requested_page, *image_options.values())
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    pdf = prepare_pdf(json)
+    response = get_png_preview_for_pdf(pdf, page_number=requested_page, **image_options)
+    response.set_etag(etag)
+    return response
+
+
+@preview_blueprint.route("/preview-pages.json", methods=["POST"])
+@auth.login_required
+def view_letter_template_pngs():
+    """
+    POST /preview-pages.json?pages=1,3 with the same json blob as /preview.png
+
+    returns base64 encoded PNGs of the requested pages, or every page if `pages` isn't given. Like /preview.png, it
+    takes `dpi` or `width`, `format` and `compression`, to get smaller, WebP or uncompressed images:
+    {
+        "page_count": 3,
+        "pages": {"1": "...", "3": "..."}
+    }
+    """
+    json = get_and_validate_json_from_request(request, preview_schema)
+    image_options = get_image_options_from_request()
+    pdf = ensure_seekable(prepare_pdf(json))
+    page_count = get_page_count_for_pdf(pdf)
+
+    try:
+        page_numbers = [int(page) for page in request.args["pages"].split(",")] if "pages" in request.args else None
+    except ValueError:
+        abort(400, f"Invalid pages {request.args['pages']}")
+
+    # a page asked for more than once is only returned once
+    page_numbers = list(dict.fromkeys(page_numbers)) if page_numbers else list(range(1, page_count + 1))
+
+    for page_number in page_numbers:
+        if not 1 <= page_number <= page_count:
+            abort(400, f"Letter does not have a page {page_number}")
+
+    pdf.seek(0)  # pdf was read to get page count, so we have to rewind it
+    pngs = get_pngs(pdf, page_numbers, **image_options)
+
+    return jsonify(
+        page_count=page_count,
+        pages={
+            str(page_number): base64.b64encode(png.read()).decode("ascii")
+            for page_number, png in zip(page_numbers, pngs, strict=True)
+        },
+    )
 
 
 @preview_blueprint.route("/preview.pdf", methods=["POST"])
@@ -125,12 +349,42 @@ def view_letter_template_pdf():
 
     json = get_and_validate_json_from_request(request, preview_schema)
 
+    etag = get_preview_etag(json, "pdf")
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
     pdf = prepare_pdf(json)
 
-    return send_file(
+    response = send_file(
         path_or_file=pdf,
         mimetype="application/pdf",
     )
+    response.set_etag(etag)
+    return response
+
+
+def get_preview_etag(letter_json, *variant):
+    """
+    Previews are rendered from the request body alone, so the ETag can be worked out from it before rendering anything.
+    It also covers everything else that goes into a preview: the cache namespace (renderer versions and the
+    rasteriser), where logos come from, how PNGs are compressed and today's date, which letters without a date are
+    dated with.
+    """
+    return cache_digest(
+        current_app.cache.namespace,
+        current_app.json.dumps(letter_json, sort_keys=True),
+        letter_json.get("date") or date.today().isoformat(),
+        current_app.config["LETTER_LOGO_URL"],
+        current_app.config["PREVIEW_PNG_COMPRESSION_LEVEL"],
+        current_app.config["PREVIEW_PNG_COMPRESSION_FILTER"],
+        *variant,
+    )
+
+
+def not_modified(etag):
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
 
 
 def prepare_pdf(letter_details):
@@ -142,28 +396,81 @@ def prepare_pdf(letter_details):
     return generate_templated_pdf(letter_details, create_pdf_for_letter, purpose)
 
 
-def get_png_preview_for_pdf(pdf, page_number):
-    pdf_persist = BytesIO(pdf) if isinstance(pdf, bytes) else BytesIO(pdf.read())
+def get_png_preview_for_pdf(pdf, page_number, dpi=PREVIEW_DPI, image_format="png", compression="default"):
+    # we read the pdf more than once, so it can't be a StreamingBody from boto
+    pdf_persist = ensure_seekable(pdf)
     templated_letter_page_count = get_page_count_for_pdf(pdf_persist)
     if page_number <= templated_letter_page_count:
         pdf_persist.seek(0)  # pdf was read to get page count, so we have to rewind it
         png_preview = get_png(
             pdf_persist,
             page_number,
+            dpi=dpi,
+            image_format=image_format,
+            compression=compression,
         )
     else:
         abort(400, f"Letter does not have a page {page_number}")
     return send_file(
         path_or_file=png_preview,
-        mimetype="image/png",
+        mimetype=f"image/{image_format}",
     )
 
 
+def get_image_options_from_request():
+    """
+    Reads the size and format of preview images from the `dpi` or `width`, `format` and `compression` query params.
+    `width` is in pixels, and is turned into the nearest dpi for an A4 page. Previews can be smaller than the default
+    150dpi, but not bigger.
+
+    `compression=none` makes PNGs that aren't compressed, which are quicker to make but several megabytes a page, so
+    they're not cached.
+    """
+    image_format = request.args.get("format", "png")
+    if image_format not in IMAGE_FORMATS:
+        abort(400, f"format must be one of {', '.join(IMAGE_FORMATS)}")
+
+    compression = request.args.get("compression", "default")
+    if compression not in PNG_COMPRESSIONS:
+        abort(400, f"compression must be one of {', '.join(PNG_COMPRESSIONS)}")
+    if compression != "default" and image_format != "png":
+        abort(400, "compression can only be set for PNGs")
+
+    try:
+        if "width" in request.args:
+            dpi = round(int(request.args["width"]) / A4_WIDTH_IN_INCHES)
+        else:
+            dpi = int(request.args.get("dpi", PREVIEW_DPI))
+    except ValueError:
+        abort(400, "dpi and width must be whole numbers")
+
+    if not MIN_PREVIEW_DPI <= dpi <= PREVIEW_DPI:
+        abort(400, f"dpi must be between {MIN_PREVIEW_DPI} and {PREVIEW_DPI}, or width the equivalent in pixels")
+
+    return {"dpi": dpi, "image_format": image_format, "compression": compression}
+
+
+def page_extension(page_number, dpi=PREVIEW_DPI, image_format="png"):
+    # PNGs made with PREVIEW_PNG_COMPRESSION_* settings are kept apart from ones made with the encoder's defaults, like
+    # `page01.150dpi.level1.filter5.png`
+    encoder_settings = ""
+    if image_format == "png":
+        encoder_settings = "".join(
+            f".{option.removeprefix('png:compression-')}{value}" for option, value in _png_compression_options().items()
+        )
+
+    # full size PNGs with the encoder's defaults keep the keys they had before there were other sizes and formats
+    if (dpi, image_format, encoder_settings) == (PREVIEW_DPI, "png", ""):
+        return f"page{page_number:02d}.png"
+    return f"page{page_number:02d}.{dpi}dpi{encoder_settings}.{image_format}"
+
+
 @preview_blueprint.route("/letter_attachment_preview.png", methods=["POST"])
 @auth.login_required
 def view_letter_attachment_preview():
     """
-    POST /letter_attachment_preview.png?page=X with the following json blob
+    POST /letter_attachment_preview.png?page=X with the following json blob. Like /preview.png, it takes `dpi` or
+    `width`, `format` and `compression`
     {
         "letter_attachment_id": "attachment id",
         "service_id": "service id",
@@ -174,23 +481,17 @@ def view_letter_attachment_preview():
         abort(400)
 
     json = get_and_validate_json_from_request(request, letter_attachment_preview_schema)
+    image_options = get_image_options_from_request()
     requested_page = int(request.args.get("page", 1))
-    attachment_pdf = get_attachment_pdf(json["service_id"], json["letter_attachment_id"])
-    attachment_page_count = get_page_count_for_pdf(attachment_pdf)
-
-    if requested_page <= attachment_page_count:
-        encoded_string = base64.b64encode(attachment_pdf)
-        png_preview = get_png_from_precompiled(
-            encoded_string=encoded_string,
-            page_number=requested_page,
-            hide_notify=False,
-        )
-    else:
-        abort(400, f"Letter attachment does not have a page {requested_page}")
 
     return send_file(
-        path_or_file=png_preview,
-        mimetype="image/png",
+        path_or_file=get_attachment_png(
+            json["service_id"],
+            json["letter_attachment_id"],
+            requested_page,
+            **image_options,
+        ),
+        mimetype=f"image/{image_options['image_format']}",
     )
 
 
@@ -227,33 +528,104 @@ def get_pdf(html) -> BytesIO:
     return _get()
 
 
-def get_png(pdf, page_number):
-    @current_app.cache(pdf.read(), folder="templated", extension=f"page{page_number:02d}.png")
+def get_png(pdf, page_number, dpi=PREVIEW_DPI, image_format="png", compression="default"):
     def _get():
         pdf.seek(0)
         return png_from_pdf(
             pdf,
             page_number=page_number,
+            dpi=dpi,
+            image_format=image_format,
+            compression=compression,
         )
 
-    return _get()
+    # PNGs that aren't compressed are several megabytes, so they're made again each time rather than cached
+    if compression == "none":
+        return _get()
 
+    # a PDF that came out of the cache already has a digest, so its pages can share it rather than hashing the PDF.
+    # Others, like Welsh letters that were stitched together, get hashed as they are
+    return current_app.cache(
+        pdf,
+        folder="templated",
+        extension=page_extension(page_number, dpi, image_format),
+        digest=getattr(pdf, "cache_digest", None),
+    )(_get)()
 
-def get_png_from_precompiled(encoded_string: bytes, page_number, hide_notify):
-    @current_app.cache(
-        encoded_string.decode("ascii"),
-        hide_notify,
-        folder="precompiled",
-        extension=f"page{page_number:02d}.png",
+
+def get_pngs(pdf, page_numbers, dpi=PREVIEW_DPI, image_format="png", compression="default"):
+    """
+    Like calling `get_png` for each page, except that any pages that aren't cached are rasterised together.
+    """
+    if compression == "none":
+        pdf.seek(0)
+        return pngs_from_pdf(pdf, page_numbers, dpi=dpi, image_format=image_format, compression=compression)
+
+    extensions = {page_extension(page_number, dpi, image_format): page_number for page_number in page_numbers}
+
+    def _get(missing_extensions):
+        pdf.seek(0)
+        return pngs_from_pdf(
+            pdf,
+            [extensions[extension] for extension in missing_extensions],
+            dpi=dpi,
+            image_format=image_format,
+        )
+
+    pngs = current_app.cache.get_or_create_many(
+        "templated",
+        getattr(pdf, "cache_digest", None) or cache_digest(pdf),
+        list(extensions),
+        _get,
     )
+    return [pngs[page_extension(page_number, dpi, image_format)] for page_number in page_numbers]
+
+
+def get_attachment_png(
+    service_id, attachment_id, page_number, dpi=PREVIEW_DPI, image_format="png", compression="default"
+):
+    def _get():
+        attachment_pdf = get_attachment_pdf(service_id, attachment_id)
+        if page_number > get_page_count_for_pdf(attachment_pdf):
+            abort(400, f"Letter attachment does not have a page {page_number}")
+        return png_from_pdf(
+            attachment_pdf, page_number=page_number, dpi=dpi, image_format=image_format, compression=compression
+        )
+
+    if compression == "none":
+        return _get()
+
+    # attachments don't change once they're uploaded, so their pages are keyed by id. Hits don't need to download them
+    return current_app.cache(
+        service_id,
+        attachment_id,
+        folder="attachments",
+        extension=page_extension(page_number, dpi, image_format),
+    )(_get)()
+
+
+def get_png_from_precompiled(
+    encoded_string: bytes, page_number, hide_notify, dpi=PREVIEW_DPI, image_format="png", compression="default"
+):
     def _get():
         return png_from_pdf(
             base64.decodebytes(encoded_string),
             page_number=page_number,
             hide_notify=hide_notify,
+            dpi=dpi,
+            image_format=image_format,
+            compression=compression,
         )
 
-    return _get()
+    if compression == "none":
+        return _get()
+
+    return current_app.cache(
+        encoded_string,
+        hide_notify,
+        folder="precompiled",
+        extension=page_extension(page_number, dpi, image_format),
+    )(_get)()
 
 
 @preview_blueprint.route("/precompiled-preview.png", methods=["POST"])
@@ -265,16 +637,23 @@ def view_precompiled_letter():
         if not encoded_string:
             abort(400)
 
+        if current_app.cache.get_failure(encoded_string, folder="precompiled"):
+            abort(400)
+
+        image_options = get_image_options_from_request()
+
         return send_file(
             path_or_file=get_png_from_precompiled(
                 encoded_string,
                 int(request.args.get("page", 1)),
                 hide_notify=request.args.get("hide_notify", "") == "true",
+                **image_options,
             ),
-            mimetype="image/png",
+            mimetype=f"image/{image_options['image_format']}",
         )
 
     # catch invalid pdfs
     except MissingDelegateError as e:
         current_app.logger.warning("Failed to generate PDF: %s", e)
+        current_app.cache.set_failure({"message": str(e)}, encoded_string, folder="precompiled")
         abort(400)
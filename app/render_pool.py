@@ -0,0 +1,210 @@
+"""
+A pool of long-lived processes that render letter HTML to PDF, so web and celery workers don't each pay for importing
+WeasyPrint and warming up its fonts and stylesheets.
+
+The pool's parent process imports everything and renders a letter before it forks any workers, so every worker
+starts warm. Workers take connections from a shared unix socket one at a time, and exit once their peak RSS passes
+`RENDER_POOL_MAX_RSS_BYTES`, when the parent forks a fresh one from its warm state.
+
+Each connection carries one job: a JSON request of `{"html": ..., "base_url": ...}`, answered with the PDF. Messages
+are a one byte status and a four byte length, followed by that many bytes.
+"""
+
+import json
+import os
+import resource
+import signal
+import socket
+import struct
+
+from flask import current_app, request
+
+from app.weasyprint_hack import LetterHTML, WeasyprintError
+
+HEADER = struct.Struct(">cI")
+STATUS_OK = b"O"
+STATUS_WEASYPRINT_ERROR = b"W"
+STATUS_ERROR = b"E"
+
+WARM_UP_LETTER = {
+    "letter_contact_block": "",
+    "template": {
+        "id": 1,
+        "template_type": "letter",
+        "subject": "Warming up",
+        "content": "Dear ((name)),\n\n# Heading\n\n* one\n* two\n\n1. one\n2. two",
+        "updated_at": "2017-08-01",
+        "version": 1,
+        "service": "",
+    },
+    "values": {"name": "Render pool"},
+    "filename": None,
+}
+
+
+class RenderPoolError(Exception):
+    pass
+
+
+def HTML(string):
+    """
+    Stands in for `LetterHTML`. If `RENDER_POOL_SOCKET_PATH` is set, `write_pdf` hands the letter to the render pool.
+    Like `LetterHTML`, it needs a request context.
+    """
+    if current_app.config["RENDER_POOL_SOCKET_PATH"]:
+        return PooledHTML(string)
+    return LetterHTML(string)
+
+
+class PooledHTML:
+    def __init__(self, string):
+        self.string = string
+        self.base_url = request.url
+
+    def write_pdf(self) -> bytes:
+        try:
+            return render_pdf(
+                current_app.config["RENDER_POOL_SOCKET_PATH"],
+                self.string,
+                self.base_url,
+                timeout=current_app.config["RENDER_POOL_TIMEOUT_SECONDS"],
+            )
+        except (FileNotFoundError, ConnectionError) as e:
+            # the pool isn't running, or the worker rendering this letter died. Timeouts aren't retried here: the
+            # letter would most likely time out again
+            current_app.logger.warning("Render pool unavailable, rendering in process: %r", e)
+            current_app.statsd_client.incr("render-pool.fallback")
+
+        with current_app.test_request_context(self.base_url):
+            html = LetterHTML(self.string)
+        return html.write_pdf()
+
+
+def render_pdf(socket_path, html, base_url, timeout=None) -> bytes:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        send_message(connection, STATUS_OK, json.dumps({"html": html, "base_url": base_url}).encode("utf-8"))
+        status, payload = receive_message(connection)
+
+    if status == STATUS_WEASYPRINT_ERROR:
+        raise WeasyprintError(payload.decode("utf-8"))
+    if status != STATUS_OK:
+        raise RenderPoolError(payload.decode("utf-8"))
+    return payload
+
+
+def send_message(connection, status, payload: bytes):
+    connection.sendall(HEADER.pack(status, len(payload)) + payload)
+
+
+def receive_message(connection) -> tuple[bytes, bytes]:
+    status, length = HEADER.unpack(_receive_exactly(connection, HEADER.size))
+    return status, _receive_exactly(connection, length)
+
+
+def _receive_exactly(connection, length) -> bytes:
+    data = bytearray()
+    while len(data) < length:
+        if not (chunk := connection.recv(min(length - len(data), 1024 * 1024))):
+            raise ConnectionResetError("Connection closed mid-message")
+        data += chunk
+    return bytes(data)
+
+
+class RenderPool:
+    def __init__(self, application, socket_path, processes, max_rss_bytes):
+        self.application = application
+        self.socket_path = socket_path
+        self.processes = processes
+        self.max_rss_bytes = max_rss_bytes
+        self.listener = None
+        self.workers = set()
+        self.stopping = False
+
+    def serve_forever(self):
+        self.warm_up()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(self.processes * 4)
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for _ in range(self.processes):
+            self.spawn()
+
+        while self.workers:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            self.workers.discard(pid)
+            if not self.stopping:
+                self.application.statsd_client.incr("render-pool.recycled")
+                self.spawn()
+
+        self.listener.close()
+        os.unlink(self.socket_path)
+
+    def warm_up(self):
+        # imported here because app.preview imports this module
+        from app.preview import get_html
+
+        with self.application.test_request_context(""):
+            LetterHTML(get_html(WARM_UP_LETTER)).write_pdf()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+
+    def spawn(self):
+        if pid := os.fork():
+            self.workers.add(pid)
+            return
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            self.work()
+        finally:
+            os._exit(0)
+
+    def work(self):
+        # every worker renders at least one letter, so a limit below the size of a warm worker can't make the parent
+        # fork workers in a loop
+        while True:
+            connection, _ = self.listener.accept()
+            with connection:
+                try:
+                    self.handle(connection)
+                except OSError:
+                    # the caller went away, maybe because it timed out
+                    self.application.logger.warning("Render pool couldn't reply to a job", exc_info=True)
+
+            if self.should_recycle():
+                return
+
+    def should_recycle(self):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 > self.max_rss_bytes
+
+    def handle(self, connection):
+        try:
+            _, payload = receive_message(connection)
+            job = json.loads(payload)
+            with self.application.test_request_context(job["base_url"]):
+                html = LetterHTML(job["html"])
+            send_message(connection, STATUS_OK, html.write_pdf())
+        except WeasyprintError as e:
+            send_message(connection, STATUS_WEASYPRINT_ERROR, str(e).encode("utf-8"))
+        except Exception as e:
+            self.application.logger.exception("Render pool job failed")
+            send_message(connection, STATUS_ERROR, repr(e).encode("utf-8"))
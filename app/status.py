@@ -1,8 +1,9 @@
+import os
 import subprocess
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 
-from app import version
+from app import auth, version
 
 status_blueprint = Blueprint("status_blueprint", __name__)
 
@@ -19,11 +20,22 @@ def _status():
             build_time=version.__time__,
             ghostscript_version=get_ghostscript_version(),
             imagemagick_version=get_imagemagick_version(),
+            letter_cache_namespace=current_app.cache.namespace,
         ),
         200,
     )
 
 
+@status_blueprint.route("/_status/cache")
+@auth.login_required
+def cache_stats():
+    """
+    Rolling letter cache stats for whichever worker process handles the request. Stats are per process, so use statsd
+    for totals across workers.
+    """
+    return jsonify(pid=os.getpid(), **current_app.cache.stats.snapshot()), 200
+
+
 def get_imagemagick_version():
     return subprocess.check_output("convert -version", shell=True).decode("utf-8")
 
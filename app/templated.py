@@ -1,6 +1,9 @@
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
+from flask import copy_current_request_context, current_app, has_request_context
+
 from app.letter_attachments import add_attachment_to_letter
 from app.transformation import convert_pdf_to_cmyk
 from app.utils import PDFPurpose, stitch_pdfs
@@ -9,21 +12,31 @@ from app.utils import PDFPurpose, stitch_pdfs
 def generate_templated_pdf(
     letter_details, create_pdf_lambda: Callable[[dict, str, bool], BytesIO], purpose: PDFPurpose
 ):
+    pdf = render_templated_pdf(letter_details, create_pdf_lambda)
+
+    if purpose == PDFPurpose.PRINT:
+        pdf = convert_pdf_to_cmyk(pdf)
+
+    return add_letter_attachment(letter_details, pdf)
+
+
+def render_templated_pdf(letter_details, create_pdf_lambda: Callable[[dict, str, bool], BytesIO]) -> BytesIO:
     # todo: remove `.get()` when all celery tasks are sending this key
     if letter_details["template"].get("letter_languages") == "welsh_then_english":
-        welsh_pdf = create_pdf_lambda(letter_details, language="welsh", include_tag=True)
-        english_pdf = create_pdf_lambda(letter_details, language="english", include_tag=False)
+        welsh_pdf, english_pdf = render_languages(
+            lambda: create_pdf_lambda(letter_details, language="welsh", include_tag=True),
+            lambda: create_pdf_lambda(letter_details, language="english", include_tag=False),
+        )
 
-        pdf = stitch_pdfs(
+        return stitch_pdfs(
             first_pdf=welsh_pdf,
             second_pdf=english_pdf,
         )
-    else:
-        pdf = create_pdf_lambda(letter_details, language="english", include_tag=True)
 
-    if purpose == PDFPurpose.PRINT:
-        pdf = convert_pdf_to_cmyk(pdf)
+    return create_pdf_lambda(letter_details, language="english", include_tag=True)
 
+
+def add_letter_attachment(letter_details, pdf: BytesIO) -> BytesIO:
     # Letter attachments are passed through `/precompiled/sanitise` endpoint, so already in CMYK.
     if letter_attachment := letter_details["template"].get("letter_attachment"):
         pdf = add_attachment_to_letter(
@@ -32,3 +45,35 @@ def generate_templated_pdf(
             attachment_object=letter_attachment,
         )
     return pdf
+
+
+def render_languages(*renders: Callable):
+    """
+    Calls each of `renders`, one for each language of a letter, and returns their results in the same order.
+
+    With `RENDER_LANGUAGES_IN_PARALLEL` and a render pool, each is called in its own thread, so the pool renders the
+    languages at the same time. Without a pool they're called one after the other, because rendering in process holds
+    the GIL. Threads get a copy of the current request or app context, but not celery's task context, so don't call
+    `task.retry` in them.
+    """
+    if len(renders) < 2 or not (
+        current_app.config["RENDER_LANGUAGES_IN_PARALLEL"] and current_app.config["RENDER_POOL_SOCKET_PATH"]
+    ):
+        return [render() for render in renders]
+
+    with ThreadPoolExecutor(max_workers=len(renders)) as executor:
+        futures = [executor.submit(_with_current_context(render)) for render in renders]
+        return [future.result() for future in futures]
+
+
+def _with_current_context(function):
+    if has_request_context():
+        return copy_current_request_context(function)
+
+    application = current_app._get_current_object()
+
+    def wrapper():
+        with application.app_context():
+            return function()
+
+    return wrapper
@@ -7,6 +7,7 @@ import sentry_sdk
 from flask import current_app
 
 from app import InvalidRequest
+from app.utils import join_pdfs, split_pdf
 
 
 def _does_pdf_contain_colorspace(colourspace, data):
@@ -73,3 +74,26 @@ def convert_pdf_to_cmyk(input_data):
             f"{gs_process.returncode}\nstdout: {stdout}\nstderr:{stderr}"
         )
     return BytesIO(stdout)
+
+
+@sentry_sdk.trace
+def convert_pdfs_to_cmyk(pdfs: list[BytesIO]) -> list[BytesIO]:
+    """
+    Converts several PDFs to CMYK with one Ghostscript process rather than one each, by joining them together and
+    splitting the result. Ghostscript keeps one page for each page it's given, so each PDF gets its own pages back.
+    """
+    if len(pdfs) == 1:
+        return [convert_pdf_to_cmyk(pdfs[0])]
+
+    joined_pdf, page_counts = join_pdfs(pdfs)
+    cmyk_pdf = convert_pdf_to_cmyk(joined_pdf)
+
+    if (cmyk_page_count := len(fitz.open(stream=cmyk_pdf.getvalue(), filetype="pdf"))) != sum(page_counts):
+        current_app.logger.warning(
+            "Ghostscript returned %s pages for %s, converting PDFs one at a time", cmyk_page_count, sum(page_counts)
+        )
+        for pdf in pdfs:
+            pdf.seek(0)
+        return [convert_pdf_to_cmyk(pdf) for pdf in pdfs]
+
+    return split_pdf(cmyk_pdf, page_counts)
@@ -1,5 +1,6 @@
 from enum import StrEnum, auto
 from io import BytesIO
+from typing import BinaryIO
 
 import sentry_sdk
 from pypdf import PdfReader, PdfWriter
@@ -17,6 +18,58 @@ def stitch_pdfs(first_pdf: BytesIO, second_pdf: BytesIO) -> BytesIO:
     return pdf_bytes
 
 
+@sentry_sdk.trace
+def join_pdfs(pdfs: list[BinaryIO]) -> tuple[BytesIO, list[int]]:
+    """
+    Returns one PDF with the pages of all of `pdfs`, and how many pages each of them had, to split it again with
+    `split_pdf`.
+    """
+    output = PdfWriter()
+    page_counts = []
+    for pdf in pdfs:
+        reader = PdfReader(pdf)
+        output.append_pages_from_reader(reader)
+        page_counts.append(len(reader.pages))
+
+    pdf_bytes = BytesIO()
+    output.write(pdf_bytes)
+    pdf_bytes.seek(0)
+    return pdf_bytes, page_counts
+
+
+@sentry_sdk.trace
+def split_pdf(pdf: BinaryIO, page_counts: list[int]) -> list[BytesIO]:
+    """
+    Returns a PDF for each of `page_counts`, made of that many of the pages of `pdf` in turn.
+    """
+    reader = PdfReader(pdf)
+    pdfs = []
+    start = 0
+    for page_count in page_counts:
+        output = PdfWriter()
+        for page in reader.pages[start : start + page_count]:
+            output.add_page(page)
+        start += page_count
+
+        pdf_bytes = BytesIO()
+        output.write(pdf_bytes)
+        pdf_bytes.seek(0)
+        pdfs.append(pdf_bytes)
+    return pdfs
+
+
+def ensure_seekable(pdf: bytes | BinaryIO) -> BinaryIO:
+    """
+    Returns a file-like object that can be read more than once. Buffers and files are returned as they are, rather
+    than copied. Only bytes and one-shot streams, like the StreamingBody that boto returns, need wrapping.
+    """
+    if isinstance(pdf, bytes):
+        return BytesIO(pdf)
+    if not pdf.seekable():
+        return BytesIO(pdf.read())
+    return pdf
+
+
 class PDFPurpose(StrEnum):
     PREVIEW = auto()
     PRINT = auto()
@@ -1,6 +1,18 @@
 import logging
+import re
+import threading
+from collections import OrderedDict
 
+import weasyprint
+from flask import current_app, request
+from flask_weasyprint import make_url_fetcher
+from weasyprint.css.counters import CounterStyle
 from weasyprint.logger import LOGGER as weasyprint_logs
+from weasyprint.text.fonts import FontConfiguration
+
+# only plain <style> elements are taken out of the HTML. Anything with a media query or another type is left for
+# WeasyPrint to deal with
+STYLE_ELEMENT = re.compile(r"<style(?:\s+type=[\"']text/css[\"'])?\s*>(.*?)</style>", re.DOTALL | re.IGNORECASE)
 
 
 class WeasyprintError(Exception):
@@ -15,3 +27,76 @@ def init_app(application):
             return weasyprint_logs.log(logging.ERROR, msg, *args, **kwargs)
 
     weasyprint_logs.error = evil_error
+
+
+class RenderContext:
+    """
+    The font configuration and parsed stylesheets that every letter shares, so they're built once per worker rather
+    than for every render. Stylesheets are parsed with the context's font configuration, which is what turns their
+    @font-face rules into fonts, so the two can only be used together.
+
+    WeasyPrint objects aren't safe to share between threads, so each thread gets its own context from `get`.
+    """
+
+    MAX_STYLESHEETS = 16
+
+    _local = threading.local()
+
+    def __init__(self):
+        self.font_config = FontConfiguration()
+        self.counter_style = CounterStyle()
+        self.stylesheets = OrderedDict()
+
+    @classmethod
+    def get(cls):
+        if not hasattr(cls._local, "context"):
+            cls._local.context = cls()
+        return cls._local.context
+
+    def stylesheet(self, css, base_url, url_fetcher) -> weasyprint.CSS:
+        key = (css, base_url)
+        if key in self.stylesheets:
+            self.stylesheets.move_to_end(key)
+            return self.stylesheets[key]
+
+        stylesheet = weasyprint.CSS(
+            string=css,
+            base_url=base_url,
+            url_fetcher=url_fetcher,
+            font_config=self.font_config,
+            counter_style=self.counter_style,
+        )
+        self.stylesheets[key] = stylesheet
+        while len(self.stylesheets) > self.MAX_STYLESHEETS:
+            self.stylesheets.popitem(last=False)
+        return stylesheet
+
+
+class LetterHTML(weasyprint.HTML):
+    """
+    Like flask_weasyprint's `HTML`, except that:
+
+    * URLs this app doesn't serve itself, like logos, are fetched through the letter cache's `fetch_asset`
+    * the letter's <style> elements are parsed once per worker by the `RenderContext`, and rendered as stylesheets
+      with the context's font configuration. They're applied as user stylesheets rather than author ones, which only
+      changes the cascade for !important declarations in style attributes. Their URLs are resolved against the app's
+      root rather than the request's URL, so requests with different query strings share them
+
+    It needs a request context too.
+    """
+
+    def __init__(self, string):
+        url_fetcher = make_url_fetcher(next_fetcher=current_app.cache.fetch_asset)
+        self.render_context = RenderContext.get()
+        self.letter_stylesheets = [
+            self.render_context.stylesheet(css, request.url_root, url_fetcher) for css in STYLE_ELEMENT.findall(string)
+        ]
+        super().__init__(string=STYLE_ELEMENT.sub("", string), base_url=request.url, url_fetcher=url_fetcher)
+
+    def render(self, font_config=None, counter_style=None, **options):
+        return super().render(
+            font_config or self.render_context.font_config,
+            counter_style or self.render_context.counter_style,
+            stylesheets=self.letter_stylesheets + (options.pop("stylesheets", None) or []),
+            **options,
+        )
@@ -11,6 +11,9 @@ case "$@" in
   web-local)
     exec flask run --host=0.0.0.0 -p $PORT
     ;;
+  render-pool)
+    exec flask run-render-pool
+    ;;
   worker)
     exec celery --quiet -A run_celery.notify_celery worker --logfile=/dev/null --concurrency="$CONCURRENCY"
     ;;
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Counts the pages of every PDF in tests/test_pdfs by reading the page tree, and by rasterising it with ImageMagick as we
+used to, and compares the counts and how long each took.
+
+    ./scripts/run_with_docker.sh python scripts/benchmark_page_count.py
+"""
+
+import glob
+import os
+import sys
+import time
+from unittest import mock
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa
+from app.preview import get_page_count_for_pdf  # noqa
+
+
+def time_page_count(pdf):
+    start = time.monotonic()
+    page_count = get_page_count_for_pdf(pdf)
+    return page_count, time.monotonic() - start
+
+
+def main():
+    click.echo(f"{'file':<45}  {'pages':>5}  {'page tree (s)':>13}  {'rasterised (s)':>14}")
+    total_page_tree = total_rasterised = 0
+    for path in sorted(glob.glob("tests/test_pdfs/*.pdf")):
+        with open(path, "rb") as f:
+            pdf = f.read()
+
+        page_count, page_tree = time_page_count(pdf)
+        with mock.patch("app.preview.fitz.open", side_effect=Exception("benchmarking rasterising")):
+            rasterised_page_count, rasterised = time_page_count(pdf)
+
+        total_page_tree += page_tree
+        total_rasterised += rasterised
+        mismatch = "" if page_count == rasterised_page_count else f"  MISMATCH: rasterised {rasterised_page_count}"
+        click.echo(f"{os.path.basename(path):<45}  {page_count:>5}  {page_tree:>13.4f}  {rasterised:>14.4f}{mismatch}")
+
+    click.echo(f"{'total':<45}  {'':>5}  {total_page_tree:>13.4f}  {total_rasterised:>14.4f}")
+
+
+if __name__ == "__main__":
+    application = create_app()
+    # don't log a warning for every rasterising fallback
+    application.logger.setLevel("ERROR")
+    with application.app_context():
+        main()
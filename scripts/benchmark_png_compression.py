@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Times encoding the first page of a few test letters as PNGs at each compression level and filter, and reports how big
+they come out, to help pick PREVIEW_PNG_COMPRESSION_LEVEL and PREVIEW_PNG_COMPRESSION_FILTER.
+
+    ./scripts/run_with_docker.sh python scripts/benchmark_png_compression.py
+"""
+
+import os
+import sys
+import time
+from statistics import median
+
+import click
+from wand.image import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa
+from app.preview import PREVIEW_DPI, _png_compression_options  # noqa
+
+LETTERS = (
+    "tests/test_pdfs/valid_letter.pdf",
+    "tests/test_pdfs/public_guardian_sample.pdf",
+    "tests/test_pdfs/rgb_image.pdf",
+)
+LEVELS = (None, 0, 1, 3, 6, 9)
+FILTERS = (None, 0, 5)
+RUNS = 5
+
+
+def time_encode(page):
+    timings = []
+    for _ in range(RUNS):
+        with page.clone() as image:
+            image.format = "png"
+            image.options.update(_png_compression_options())
+            start = time.monotonic()
+            png = image.make_blob()
+            timings.append(time.monotonic() - start)
+    return median(timings), len(png)
+
+
+def main(application):
+    click.echo(f"{'letter':<30}  {'level':>7}  {'filter':>7}  {'encode (ms)':>11}  {'size (KiB)':>10}")
+    for path in LETTERS:
+        with Image(filename=path, resolution=PREVIEW_DPI) as pdf, Image(image=pdf.sequence[0]) as page:
+            for level in LEVELS:
+                for png_filter in FILTERS:
+                    application.config["PREVIEW_PNG_COMPRESSION_LEVEL"] = level
+                    application.config["PREVIEW_PNG_COMPRESSION_FILTER"] = png_filter
+                    seconds, size = time_encode(page)
+                    click.echo(
+                        f"{os.path.basename(path):<30}  {str(level):>7}  {str(png_filter):>7}  "
+                        f"{seconds * 1000:>11.1f}  {size / 1024:>10.1f}"
+                    )
+
+
+if __name__ == "__main__":
+    application = create_app()
+    with application.app_context():
+        main(application)
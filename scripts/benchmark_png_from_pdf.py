@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Times `png_from_pdf` for the last page of letters of increasing length, with and without extracting the page before
+rasterising it. Extracting the page should keep the time per PNG flat however long the letter is.
+
+    ./scripts/run_with_docker.sh python scripts/benchmark_png_from_pdf.py
+"""
+
+import os
+import sys
+import time
+from statistics import median
+from unittest import mock
+
+import click
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa
+from app.preview import png_from_pdf  # noqa
+
+PAGE_COUNTS = (1, 5, 10, 20)
+RUNS = 5
+
+
+def letter_with_pages(page_count):
+    with fitz.open("tests/test_pdfs/valid_letter.pdf") as source, fitz.open() as letter:
+        for _ in range(page_count):
+            letter.insert_pdf(source, from_page=0, to_page=0)
+        return letter.tobytes()
+
+
+def time_last_page(pdf, page_count):
+    timings = []
+    for _ in range(RUNS):
+        start = time.monotonic()
+        png_from_pdf(pdf, page_number=page_count)
+        timings.append(time.monotonic() - start)
+    return median(timings)
+
+
+def main():
+    click.echo(f"{'pages':>5}  {'single page (s)':>15}  {'whole pdf (s)':>13}")
+    for page_count in PAGE_COUNTS:
+        pdf = letter_with_pages(page_count)
+        single_page = time_last_page(pdf, page_count)
+        with mock.patch("app.preview.extract_pages", side_effect=Exception("benchmarking the whole PDF")):
+            whole_pdf = time_last_page(pdf, page_count)
+        click.echo(f"{page_count:>5}  {single_page:>15.3f}  {whole_pdf:>13.3f}")
+
+
+if __name__ == "__main__":
+    application = create_app()
+    # don't log a warning for every whole PDF fallback
+    application.logger.setLevel("ERROR")
+    with application.app_context():
+        main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Compares the wand and pymupdf preview rasterisers, by timing `pngs_from_pdf` for every page of a few test letters and
+measuring the peak memory of the process doing it, including Ghostscript.
+
+    ./scripts/run_with_docker.sh python scripts/benchmark_rasterisers.py
+"""
+
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from statistics import median
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa
+from app.preview import RASTERISERS, get_page_count_for_pdf, pngs_from_pdf  # noqa
+
+LETTERS = (
+    "tests/test_pdfs/valid_letter.pdf",
+    "tests/test_pdfs/multi_page_pdf.pdf",
+    "tests/test_pdfs/cmyk_and_rgb_in_one_pdf.pdf",
+    "tests/test_pdfs/public_guardian_sample.pdf",
+)
+RUNS = 5
+
+
+def benchmark(rasteriser):
+    """
+    Runs in a fresh process for each rasteriser, so the peak memory is only that rasteriser's
+    """
+    application = create_app()
+    application.config["PREVIEW_RASTERISER"] = rasteriser
+    application.logger.setLevel("ERROR")
+
+    timings = {}
+    with application.app_context():
+        for path in LETTERS:
+            with open(path, "rb") as f:
+                pdf = f.read()
+            page_numbers = list(range(1, get_page_count_for_pdf(pdf) + 1))
+
+            runs = []
+            for _ in range(RUNS):
+                start = time.monotonic()
+                pngs_from_pdf(pdf, page_numbers)
+                runs.append(time.monotonic() - start)
+            timings[path] = (len(page_numbers), median(runs))
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    return timings, peak_rss / 1024
+
+
+def main():
+    results = {}
+    for rasteriser in RASTERISERS:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results[rasteriser] = executor.submit(benchmark, rasteriser).result()
+
+    click.echo(f"{'letter':<45}  {'pages':>5}  " + "  ".join(f"{rasteriser + ' (s)':>12}" for rasteriser in results))
+    for path in LETTERS:
+        page_count = results["wand"][0][path][0]
+        click.echo(
+            f"{os.path.basename(path):<45}  {page_count:>5}  "
+            + "  ".join(f"{timings[path][1]:>12.3f}" for timings, _ in results.values())
+        )
+    click.echo(f"{'peak rss (MiB)':<45}  {'':>5}  " + "  ".join(f"{peak:>12.1f}" for _, peak in results.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Times rendering the same templated letter with different values, parsing its stylesheets and building a font
+configuration for every render as we used to, and with the worker's render context.
+
+    ./scripts/run_with_docker.sh python scripts/benchmark_render_context.py
+"""
+
+import os
+import sys
+import time
+from statistics import median
+
+import click
+import weasyprint
+from flask import current_app, request
+from flask_weasyprint import make_url_fetcher
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa
+from app.preview import get_html  # noqa
+from app.weasyprint_hack import LetterHTML  # noqa
+
+LETTERS = 20
+CONTENT = "\n\n".join(
+    [
+        "Dear ((name)),",
+        "# Your application reference ((reference))",
+        "We have received your application for a new bike stand outside ((address)). "
+        "We will look at it within 10 working days and write to you again when we have made a decision.",
+        "* you do not need to do anything else",
+        "* if you need to change your application, call us on 0300 123 4567 and quote your reference",
+        "Some of the things we check are:",
+        "1. whether there is enough room on the pavement\n2. whether the stand would block an entrance\n"
+        "3. whether there is already a stand nearby",
+    ]
+    * 3
+)
+
+
+def letter_html(i):
+    return get_html(
+        {
+            "letter_contact_block": "Bike stands team\nCity Hall\nSW1A 1AA",
+            "template": {
+                "id": 1,
+                "template_type": "letter",
+                "subject": "Your bike stand application",
+                "content": CONTENT,
+                "updated_at": "2017-08-01",
+                "version": 1,
+                "service": "1234",
+            },
+            "values": {"name": f"Person {i}", "reference": f"REF-{i:05d}", "address": f"{i} High Street"},
+            "filename": "hm-government",
+        }
+    )
+
+
+def render_without_context(html):
+    weasyprint.HTML(
+        string=html,
+        base_url=request.url,
+        url_fetcher=make_url_fetcher(next_fetcher=current_app.cache.fetch_asset),
+    ).write_pdf()
+
+
+def render_with_context(html):
+    LetterHTML(string=html).write_pdf()
+
+
+def time_renders(render, letters):
+    timings = []
+    for html in letters:
+        start = time.monotonic()
+        render(html)
+        timings.append(time.monotonic() - start)
+    return timings
+
+
+def main():
+    letters = [letter_html(i) for i in range(LETTERS)]
+
+    # the first render of each warms up imports, fonts and the asset cache, so isn't counted
+    results = {}
+    for name, render in (("without context", render_without_context), ("with context", render_with_context)):
+        render(letters[0])
+        results[name] = time_renders(render, letters)
+
+    click.echo(f"{'':<16}  {'median (ms)':>11}  {'max (ms)':>9}")
+    for name, timings in results.items():
+        click.echo(f"{name:<16}  {median(timings) * 1000:>11.1f}  {max(timings) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    application = create_app()
+    with application.test_request_context(""):
+        main()
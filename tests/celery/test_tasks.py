@@ -11,15 +11,18 @@ from moto import mock_s3
 from pypdf import PdfReader
 
 import app.celery.tasks
+import app.transformation
 from app.celery.tasks import (
     _create_pdf_for_letter,
     _remove_folder_from_filename,
     create_pdf_for_templated_letter,
+    create_pdfs_for_templated_letters,
     recreate_pdf_for_precompiled_letter,
     sanitise_and_upload_letter,
 )
 from app.config import QueueNames
 from app.weasyprint_hack import WeasyprintError
+from tests.conftest import set_config
 from tests.pdf_consts import bad_postcode, blank_with_address, multi_page_pdf, no_colour
 
 
@@ -242,8 +245,8 @@ def test_create_pdf_for_templated_letter_includes_welsh_pages_if_provided(
     )
 
     assert mock_create_pdf.call_args_list == [
-        mocker.call(mocker.ANY, mocker.ANY, language="welsh", include_notify_tag=True),
-        mocker.call(mocker.ANY, mocker.ANY, language="english", include_notify_tag=False),
+        mocker.call(mocker.ANY, language="welsh", include_notify_tag=True),
+        mocker.call(mocker.ANY, language="english", include_notify_tag=False),
     ]
 
     assert not any(r.levelname == "ERROR" for r in caplog.records)
@@ -385,6 +388,109 @@ def test_create_pdf_for_templated_letter_html_error(mocker, data_for_create_pdf_
     mock_retry.assert_called_once_with(exc=expected_exc, queue=QueueNames.SANITISE_LETTERS)
 
 
+@pytest.fixture
+def data_for_create_pdfs_for_templated_letters_task(data_for_create_pdf_for_templated_letter_task):
+    batch = {
+        key: value
+        for key, value in data_for_create_pdf_for_templated_letter_task.items()
+        if key not in {"notification_id", "letter_filename", "values"}
+    }
+    batch["letters"] = [
+        {"notification_id": "abc-123", "letter_filename": "LETTER_1.PDF", "values": {"placeholder": "abc"}},
+        {"notification_id": "def-456", "letter_filename": "LETTER_2.PDF", "values": {"placeholder": "def " * 2000}},
+        {"notification_id": "ghi-789", "letter_filename": "LETTER_3.PDF", "values": {"placeholder": "ghi"}},
+    ]
+    return batch
+
+
+def test_create_pdfs_for_templated_letters_uploads_each_letter(
+    mocker, client, data_for_create_pdfs_for_templated_letters_task
+):
+    mock_upload = mocker.patch("app.celery.tasks.s3upload")
+    mock_celery = mocker.patch("app.celery.tasks.notify_celery.send_task")
+    mock_convert = mocker.patch("app.transformation.convert_pdf_to_cmyk", wraps=app.transformation.convert_pdf_to_cmyk)
+
+    encoded_data = current_app.signing_client.encode(data_for_create_pdfs_for_templated_letters_task)
+    page_counts = create_pdfs_for_templated_letters(encoded_data)
+
+    assert page_counts["abc-123"] == page_counts["ghi-789"] == 1
+    assert page_counts["def-456"] > 1
+    assert mock_convert.call_count == 1
+    assert [call.kwargs["file_location"] for call in mock_upload.call_args_list] == [
+        "LETTER_1.PDF",
+        "LETTER_2.PDF",
+        "LETTER_3.PDF",
+    ]
+    assert [call.kwargs["bucket_name"] for call in mock_upload.call_args_list] == [
+        current_app.config["LETTERS_PDF_BUCKET_NAME"]
+    ] * 3
+    uploaded_pdfs = [PdfReader(call.kwargs["filedata"]) for call in mock_upload.call_args_list]
+    assert [len(pdf.pages) for pdf in uploaded_pdfs] == list(page_counts.values())
+    assert "abc" in uploaded_pdfs[0].pages[0].extract_text()
+    assert "ghi" in uploaded_pdfs[2].pages[0].extract_text()
+    assert mock_celery.call_args_list == [
+        mocker.call(
+            kwargs={"notification_id": notification_id, "page_count": page_count},
+            name="update-billable-units-for-letter",
+            queue="letter-tasks",
+        )
+        for notification_id, page_count in page_counts.items()
+    ]
+
+
+def test_create_pdfs_for_templated_letters_converts_letters_in_chunks(
+    app, mocker, client, data_for_create_pdfs_for_templated_letters_task
+):
+    mocker.patch("app.celery.tasks.s3upload")
+    mocker.patch("app.celery.tasks.notify_celery.send_task")
+    mock_convert = mocker.patch("app.celery.tasks.convert_pdfs_to_cmyk", side_effect=lambda pdfs: pdfs)
+
+    encoded_data = current_app.signing_client.encode(data_for_create_pdfs_for_templated_letters_task)
+    with set_config(app, "TEMPLATED_LETTER_BATCH_CHUNK_SIZE", 2):
+        create_pdfs_for_templated_letters(encoded_data)
+
+    assert [len(call.args[0]) for call in mock_convert.call_args_list] == [2, 1]
+
+
+def test_create_pdfs_for_templated_letters_reports_letters_that_failed_to_upload(
+    mocker, client, data_for_create_pdfs_for_templated_letters_task
+):
+    mocker.patch(
+        "app.celery.tasks.s3upload",
+        side_effect=[None, BotoClientError({"Error": {"Code": "500", "Message": "error"}}, "bar"), None],
+    )
+    mock_celery = mocker.patch("app.celery.tasks.notify_celery.send_task")
+
+    encoded_data = current_app.signing_client.encode(data_for_create_pdfs_for_templated_letters_task)
+    page_counts = create_pdfs_for_templated_letters(encoded_data)
+
+    assert page_counts["def-456"] is None
+    assert page_counts["abc-123"] == page_counts["ghi-789"] == 1
+    assert [call.kwargs["kwargs"]["notification_id"] for call in mock_celery.call_args_list] == ["abc-123", "ghi-789"]
+
+
+def test_create_pdfs_for_templated_letters_retries_letters_that_werent_uploaded(
+    app, mocker, client, data_for_create_pdfs_for_templated_letters_task
+):
+    mocker.patch("app.celery.tasks.s3upload")
+    mocker.patch("app.celery.tasks.notify_celery.send_task")
+    expected_exc = WeasyprintError()
+    mocker.patch(
+        "app.celery.tasks._create_pdf_for_letter",
+        side_effect=[BytesIO(blank_with_address), expected_exc],
+    )
+    mock_retry = mocker.patch("app.celery.tasks.create_pdfs_for_templated_letters.retry", side_effect=Retry)
+
+    encoded_data = current_app.signing_client.encode(data_for_create_pdfs_for_templated_letters_task)
+    with set_config(app, "TEMPLATED_LETTER_BATCH_CHUNK_SIZE", 1), pytest.raises(Retry):
+        create_pdfs_for_templated_letters(encoded_data)
+
+    mock_retry.assert_called_once_with(args=(mocker.ANY,), exc=expected_exc, queue=QueueNames.SANITISE_LETTERS)
+    retried_batch = current_app.signing_client.decode(mock_retry.call_args.kwargs["args"][0])
+    assert [letter["notification_id"] for letter in retried_batch["letters"]] == ["def-456", "ghi-789"]
+    assert retried_batch["template"] == data_for_create_pdfs_for_templated_letters_task["template"]
+
+
 @mock_s3
 def test_recreate_pdf_for_precompiled_letter(mocker, client):
     # create backup S3 bucket and an S3 bucket for the final letters that will be sent to DVLA
@@ -493,7 +599,6 @@ def test_remove_folder_from_filename(filename, expected_filename):
 @pytest.mark.parametrize("include_notify_tag", (True, False))
 def test_create_pdf_for_letter_notify_tagging(client, include_notify_tag):
     pdf = _create_pdf_for_letter(
-        task=None,  # noqa
         letter_details={
             "template": {"template_type": "letter", "subject": "subject", "content": "content"},
             "values": {},
@@ -5,7 +5,7 @@ import pytest
 from botocore.response import StreamingBody
 from notifications_utils.s3 import S3ObjectNotFound
 
-from app import create_app
+from app import create_app, init_cache
 
 
 @pytest.fixture(scope="session")
@@ -116,12 +116,18 @@ def auth_header():
 
 @pytest.fixture(autouse=True)
 def mocked_cache_get(mocker):
-    return mocker.patch("app.s3download", side_effect=S3ObjectNotFound({}, ""))
+    return mocker.patch("app.cache.s3download", side_effect=S3ObjectNotFound({}, ""))
 
 
 @pytest.fixture(autouse=True)
 def mocked_cache_set(mocker):
-    return mocker.patch("app.s3upload")
+    return mocker.patch("app.cache.s3upload")
+
+
+@pytest.fixture
+def negative_cache(app, mocker):
+    with set_config(app, "LETTER_CACHE_NEGATIVE_TTL_SECONDS", 60):
+        yield mocker.patch.object(app, "cache", init_cache(app))
 
 
 @contextmanager
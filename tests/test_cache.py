@@ -0,0 +1,678 @@
+import os
+import threading
+from io import BytesIO
+from unittest import mock
+
+import pytest
+from notifications_utils.s3 import S3ObjectNotFound
+
+from app import init_cache
+from app.cache import (
+    AssetCache,
+    CacheStats,
+    DiskCache,
+    MemoryCache,
+    NegativeCache,
+    SingleFlight,
+    WriteBehindUploader,
+    cache_digest,
+)
+from tests.conftest import s3_response_body, set_config
+
+
+def test_cache_digest_hashes_bytes_and_files_the_same():
+    assert cache_digest(b"pdf", False) == cache_digest(BytesIO(b"pdf"), False)
+    assert len(cache_digest(b"pdf")) == 40
+
+
+@pytest.mark.parametrize(
+    "parts, other_parts",
+    [
+        (("ab", "c"), ("a", "bc")),
+        (("pdf",), (b"pdf",)),
+        ((True,), (1,)),
+        ((None,), ("None",)),
+    ],
+)
+def test_cache_digest_distinguishes_parts(parts, other_parts):
+    assert cache_digest(*parts) != cache_digest(*other_parts)
+
+
+def test_cache_digest_rewinds_files(tmp_path):
+    with open(tmp_path / "a.pdf", "w+b") as f:
+        f.write(b"pdf")
+
+        assert cache_digest(f) == cache_digest(b"pdf")
+        assert f.tell() == 0
+
+
+def test_cache_uses_digest_if_given(app, client, mocked_cache_get):
+    init_cache(app)("foo", folder="templated", extension="page01.png", digest="abc")(lambda: BytesIO(b"png"))()
+
+    mocked_cache_get.assert_called_once_with("test-template-preview-cache", "test/templated/abc.page01.png")
+
+
+def test_cache_returns_objects_with_their_digest(app, client, mocked_cache_get):
+    mocked_cache_get.side_effect = [s3_response_body(b"pdf")]
+
+    data = init_cache(app)("<html>", folder="templated", extension="pdf")(lambda: BytesIO(b"rendered"))()
+
+    assert data.read() == b"pdf"
+    assert data.cache_digest == cache_digest("<html>")
+
+
+def test_cache_namespace_changes_with_renderer_versions(app, mocker):
+    mocker.patch("app.cache.renderer_versions", side_effect=[{"WeasyPrint": "59.0"}, {"WeasyPrint": "60.0"}])
+
+    with set_config(app, "LETTER_CACHE_NAMESPACE", None):
+        namespace = init_cache(app).namespace
+        assert namespace != init_cache(app).namespace
+
+    assert len(namespace) == 12
+
+
+def test_cache_namespace_changes_with_cache_version(app, mocker):
+    mocker.patch("app.cache.renderer_versions", return_value={"WeasyPrint": "59.0"})
+
+    with set_config(app, "LETTER_CACHE_NAMESPACE", None):
+        namespace = init_cache(app).namespace
+        with set_config(app, "LETTER_CACHE_VERSION", "2"):
+            assert namespace != init_cache(app).namespace
+
+
+def test_cache_namespace_changes_with_rasteriser(app, mocker):
+    mocker.patch("app.cache.renderer_versions", return_value={"WeasyPrint": "59.0"})
+
+    with set_config(app, "LETTER_CACHE_NAMESPACE", None):
+        namespace = init_cache(app).namespace
+        with set_config(app, "PREVIEW_RASTERISER", "pymupdf"):
+            assert namespace != init_cache(app).namespace
+
+
+@pytest.mark.parametrize(
+    "digest, expected_cache_keys",
+    [
+        # "00000000" is below the migration rate, so it's rendered again rather than served from the old namespace
+        ("00000000", ["test/templated/00000000.pdf"]),
+        ("ffffffff", ["test/templated/ffffffff.pdf", "old/templated/ffffffff.pdf"]),
+    ],
+)
+def test_cache_falls_back_to_previous_namespace_for_keys_not_migrated_yet(
+    app, client, mocked_cache_get, mocked_cache_set, digest, expected_cache_keys
+):
+    with (
+        set_config(app, "LETTER_CACHE_PREVIOUS_NAMESPACE", "old"),
+        set_config(app, "LETTER_CACHE_MIGRATION_RATE", 0.5),
+    ):
+        cache = init_cache(app)
+        cache(folder="templated", extension="pdf", digest=digest)(lambda: BytesIO(b"rendered"))()
+
+    assert [call[0][1] for call in mocked_cache_get.call_args_list] == expected_cache_keys
+    assert mocked_cache_set.call_args[0][3] == f"test/templated/{digest}.pdf"
+
+
+def test_cache_serves_previous_namespace_hits_without_rendering(
+    app, client, mocker, mocked_cache_get, mocked_cache_set
+):
+    mocked_cache_get.side_effect = [S3ObjectNotFound({}, ""), s3_response_body(b"old render")]
+    mock_incr = mocker.patch.object(app.statsd_client, "incr")
+
+    with (
+        set_config(app, "LETTER_CACHE_PREVIOUS_NAMESPACE", "old"),
+        set_config(app, "LETTER_CACHE_MIGRATION_RATE", 0),
+    ):
+        data = init_cache(app)("foo", folder="templated", extension="pdf")(lambda: BytesIO(b"rendered"))()
+
+    assert data.read() == b"old render"
+    assert not mocked_cache_set.called
+    assert mocker.call("letter-cache.migration.previous-hit", 1) in mock_incr.call_args_list
+
+
+def test_negative_cache_forgets_results_after_ttl(mocker):
+    mock_time = mocker.patch("app.cache.time.time", return_value=1000)
+    negative_cache = NegativeCache(ttl=60)
+
+    negative_cache.set("sanitise/abc.failure.json", {"message": "letter-too-long"})
+
+    mock_time.return_value = 1060
+    assert negative_cache.get("sanitise/abc.failure.json") == {"message": "letter-too-long"}
+    mock_time.return_value = 1061
+    assert negative_cache.get("sanitise/abc.failure.json") is None
+
+
+def test_negative_cache_shares_results_between_processes_on_disk(tmp_path):
+    NegativeCache(ttl=60, disk_cache=DiskCache(str(tmp_path), max_bytes=100)).set("abc", {"message": "bad"})
+
+    assert NegativeCache(ttl=60, disk_cache=DiskCache(str(tmp_path), max_bytes=100)).get("abc") == {"message": "bad"}
+    assert NegativeCache(ttl=60).get("abc") is None
+
+
+def test_cache_doesnt_remember_failures_if_negative_ttl_is_zero(app):
+    cache = init_cache(app)
+
+    cache.set_failure({"message": "bad"}, b"pdf", folder="sanitise")
+
+    assert cache.get_failure(b"pdf", folder="sanitise") is None
+
+
+def test_asset_cache_forgets_assets_after_ttl(mocker):
+    mock_time = mocker.patch("app.cache.time.time", return_value=1000)
+    asset_cache = AssetCache(ttl=60)
+
+    asset_cache.set("assets/abc", {"string": b"<svg/>", "mime_type": "image/svg+xml", "redirected_url": "http://a"})
+
+    mock_time.return_value = 1060
+    assert asset_cache.get("assets/abc") == {
+        "string": b"<svg/>",
+        "mime_type": "image/svg+xml",
+        "redirected_url": "http://a",
+    }
+    mock_time.return_value = 1061
+    assert asset_cache.get("assets/abc") is None
+
+
+def test_asset_cache_shares_assets_between_processes_on_disk(tmp_path):
+    AssetCache(ttl=60, disk_cache=DiskCache(str(tmp_path), max_bytes=1000)).set("assets/abc", {"string": b"<svg/>"})
+
+    assert AssetCache(ttl=60, disk_cache=DiskCache(str(tmp_path), max_bytes=1000)).get("assets/abc") == {
+        "string": b"<svg/>"
+    }
+    assert AssetCache(ttl=60).get("assets/abc") is None
+
+
+def test_asset_cache_doesnt_store_assets_bigger_than_max_bytes(tmp_path):
+    asset_cache = AssetCache(ttl=60, disk_cache=DiskCache(str(tmp_path), max_bytes=1000), max_bytes=5)
+
+    asset_cache.set("assets/abc", {"string": b"<svg/>"})
+
+    assert asset_cache.get("assets/abc") is None
+
+
+@pytest.fixture
+def asset_cache(app):
+    with set_config(app, "LETTER_ASSET_CACHE_TTL_SECONDS", 60):
+        yield init_cache(app)
+
+
+def test_cache_fetches_each_asset_once(asset_cache, mocker):
+    mock_fetch = mocker.patch(
+        "app.cache.weasyprint.default_url_fetcher",
+        return_value={"file_obj": BytesIO(b"<svg/>"), "mime_type": "image/svg+xml"},
+    )
+
+    first = asset_cache.fetch_asset("https://static.example.com/logos/hm-government.svg")
+    second = asset_cache.fetch_asset("https://static.example.com/logos/hm-government.svg")
+
+    assert first == second == {"string": b"<svg/>", "mime_type": "image/svg+xml"}
+    mock_fetch.assert_called_once_with("https://static.example.com/logos/hm-government.svg")
+    assert asset_cache.stats.snapshot()["hit_ratios"]["letter-cache.assets"] == 0.5
+
+
+def test_cache_doesnt_remember_failed_asset_fetches(asset_cache, mocker):
+    mock_fetch = mocker.patch("app.cache.weasyprint.default_url_fetcher", side_effect=OSError("404"))
+
+    for _ in range(2):
+        with pytest.raises(OSError):
+            asset_cache.fetch_asset("https://static.example.com/logos/missing.svg")
+
+    assert mock_fetch.call_count == 2
+
+
+@pytest.mark.parametrize("url", ["data:image/png;base64,iVBORw0KGgo=", "file:///etc/fonts/font.ttf"])
+def test_cache_only_keeps_assets_fetched_over_http(asset_cache, mocker, url):
+    mock_fetch = mocker.patch("app.cache.weasyprint.default_url_fetcher", return_value={"string": b"asset"})
+
+    asset_cache.fetch_asset(url)
+    asset_cache.fetch_asset(url)
+
+    assert mock_fetch.call_count == 2
+
+
+def test_cache_fetches_assets_every_time_if_asset_ttl_is_zero(app, mocker):
+    mock_fetch = mocker.patch("app.cache.weasyprint.default_url_fetcher", return_value={"string": b"<svg/>"})
+    cache = init_cache(app)
+
+    cache.fetch_asset("https://static.example.com/logos/hm-government.svg")
+    cache.fetch_asset("https://static.example.com/logos/hm-government.svg")
+
+    assert mock_fetch.call_count == 2
+
+
+def test_cache_stats_roll_over_the_window(mocker):
+    mock_monotonic = mocker.patch("app.cache.time.monotonic", return_value=1000)
+    cache_stats = CacheStats(window_seconds=60, bucket_seconds=10)
+
+    cache_stats.add("letter-cache.templated.pdf.hit", 1)
+    mock_monotonic.return_value = 1030
+    cache_stats.add("letter-cache.templated.pdf.hit", 1)
+    cache_stats.add("letter-cache.templated.pdf.miss", 1)
+    cache_stats.add("letter-cache.templated.pdf.render-time", 0.5)
+    cache_stats.add("letter-cache.templated.pdf.render-time", 1.5)
+
+    assert cache_stats.snapshot() == {
+        "window_seconds": 60,
+        "stats": {
+            "letter-cache.templated.pdf.hit": {"count": 2, "total": 2, "max": 1},
+            "letter-cache.templated.pdf.miss": {"count": 1, "total": 1, "max": 1},
+            "letter-cache.templated.pdf.render-time": {"count": 2, "total": 2.0, "max": 1.5},
+        },
+        "hit_ratios": {"letter-cache.templated.pdf": 2 / 3},
+    }
+
+    mock_monotonic.return_value = 1075
+    assert cache_stats.snapshot()["hit_ratios"] == {"letter-cache.templated.pdf": 1 / 2}
+
+    mock_monotonic.return_value = 1100
+    assert cache_stats.snapshot()["stats"] == {}
+
+
+def test_cache_sends_stats_for_each_kind_of_object(app, client, mocker, mocked_cache_get):
+    mocked_cache_get.side_effect = [S3ObjectNotFound({}, ""), s3_response_body(b"pdf")]
+    mock_incr = mocker.patch.object(app.statsd_client, "incr")
+    mock_timing = mocker.patch.object(app.statsd_client, "timing")
+    cache = init_cache(app)
+
+    cache("foo", folder="templated", extension="page01.png")(lambda: BytesIO(b"png"))()
+    cache("bar", folder="templated", extension="pdf")(lambda: BytesIO(b"rendered"))()
+
+    assert mock_incr.call_args_list == [
+        mocker.call("letter-cache.s3.miss", 1),
+        mocker.call("letter-cache.templated.png.miss", 1),
+        mocker.call("letter-cache.templated.png.upload-bytes", 3),
+        mocker.call("letter-cache.s3.hit", 1),
+        mocker.call("letter-cache.templated.pdf.download-bytes", 3),
+        mocker.call("letter-cache.templated.pdf.hit", 1),
+    ]
+    assert [call[0][0] for call in mock_timing.call_args_list] == [
+        "letter-cache.templated.png.render-time",
+        "letter-cache.templated.png.upload-time",
+        "letter-cache.templated.pdf.download-time",
+    ]
+    assert cache.stats.snapshot()["hit_ratios"] == {
+        "letter-cache.s3": 1 / 2,
+        "letter-cache.templated.png": 0,
+        "letter-cache.templated.pdf": 1,
+    }
+
+
+def test_memory_cache_evicts_least_recently_used_entries():
+    memory_cache = MemoryCache(max_bytes=10)
+
+    memory_cache.set("a", b"1234")
+    memory_cache.set("b", b"1234")
+    assert memory_cache.get("a") == b"1234"
+
+    memory_cache.set("c", b"1234")
+
+    assert memory_cache.get("a") == b"1234"
+    assert memory_cache.get("b") is None
+    assert memory_cache.get("c") == b"1234"
+    assert memory_cache.current_bytes == 8
+
+
+def test_memory_cache_does_not_store_objects_bigger_than_the_cache():
+    memory_cache = MemoryCache(max_bytes=10)
+
+    memory_cache.set("a", b"12345678901")
+
+    assert memory_cache.get("a") is None
+    assert memory_cache.current_bytes == 0
+
+
+def test_memory_cache_replacing_an_entry_updates_its_size():
+    memory_cache = MemoryCache(max_bytes=10)
+
+    memory_cache.set("a", b"1234")
+    memory_cache.set("a", b"12")
+
+    assert memory_cache.get("a") == b"12"
+    assert memory_cache.current_bytes == 2
+
+
+def test_disk_cache_round_trips_objects_in_folders(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), max_bytes=100)
+
+    disk_cache.set("templated/abc.pdf", b"pdf")
+
+    assert disk_cache.get("templated/abc.pdf") == b"pdf"
+    assert disk_cache.get("templated/def.pdf") is None
+    assert (tmp_path / "templated" / "abc.pdf").read_bytes() == b"pdf"
+
+
+def test_disk_cache_counts_existing_files_on_startup(tmp_path):
+    DiskCache(str(tmp_path), max_bytes=100).set("templated/abc.pdf", b"1234")
+
+    assert DiskCache(str(tmp_path), max_bytes=100).current_bytes == 4
+
+
+def test_disk_cache_evicts_least_recently_used_files(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), max_bytes=10)
+
+    disk_cache.set("a", b"1234")
+    disk_cache.set("b", b"1234")
+    os.utime(tmp_path / "a", (1, 1))
+
+    disk_cache.set("c", b"1234")
+
+    assert disk_cache.get("a") is None
+    assert disk_cache.get("b") == b"1234"
+    assert disk_cache.get("c") == b"1234"
+    assert disk_cache.current_bytes == 8
+
+
+def test_disk_cache_open_returns_a_file(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), max_bytes=100)
+    disk_cache.set("templated/abc.pdf", b"pdf")
+
+    with disk_cache.open("templated/abc.pdf") as f:
+        assert f.read() == b"pdf"
+
+    assert disk_cache.open("templated/def.pdf") is None
+
+
+def test_disk_cache_set_from_file_returns_the_rewound_file(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), max_bytes=100)
+
+    with disk_cache.set_from_file("templated/abc.pdf", s3_response_body(b"pdf")) as f:
+        assert f.read() == b"pdf"
+
+    assert disk_cache.get("templated/abc.pdf") == b"pdf"
+    assert disk_cache.current_bytes == 3
+
+
+def test_disk_cache_set_from_file_doesnt_cache_files_that_are_too_big(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), max_bytes=2)
+
+    with disk_cache.set_from_file("templated/abc.pdf", s3_response_body(b"pdf")) as f:
+        assert f.read() == b"pdf"
+
+    assert disk_cache.get("templated/abc.pdf") is None
+    assert list((tmp_path / "templated").iterdir()) == []
+    assert disk_cache.current_bytes == 0
+
+
+@pytest.fixture
+def tiered_cache(app, tmp_path):
+    with (
+        set_config(app, "LETTER_CACHE_MEMORY_MAX_BYTES", 1024),
+        set_config(app, "LETTER_CACHE_DISK_PATH", str(tmp_path)),
+    ):
+        yield init_cache(app)
+
+
+def test_cache_serves_repeat_requests_from_memory(client, tiered_cache, mocked_cache_get, mocked_cache_set):
+    def _get():
+        return BytesIO(b"rendered")
+
+    first = tiered_cache("foo", folder="templated", extension="pdf")(_get)()
+    second = tiered_cache("foo", folder="templated", extension="pdf")(_get)()
+
+    assert first.read() == second.read() == b"rendered"
+    assert mocked_cache_get.call_count == 1
+    assert mocked_cache_set.call_count == 1
+
+
+def test_cache_populates_local_tiers_from_s3(client, tiered_cache, mocked_cache_get, mocked_cache_set, tmp_path):
+    mocked_cache_get.side_effect = [s3_response_body(b"from s3")]
+
+    def _get():
+        raise AssertionError("Uncached method shouldn’t be called")
+
+    first = tiered_cache("foo", folder="templated", extension="pdf")(_get)()
+    second = tiered_cache("foo", folder="templated", extension="pdf")(_get)()
+
+    assert first.read() == second.read() == b"from s3"
+    assert mocked_cache_get.call_count == 1
+    assert not mocked_cache_set.called
+    assert [path.read_bytes() for path in (tmp_path / "test" / "templated").iterdir()] == [b"from s3"]
+
+
+def test_cache_creates_everything_that_missed_in_one_call(client, tiered_cache, mocked_cache_get, mocked_cache_set):
+    tiered_cache(digest="abc", folder="templated", extension="page02.png")(lambda: BytesIO(b"cached"))()
+    mock_create = mock.Mock(side_effect=lambda extensions: [BytesIO(extension.encode()) for extension in extensions])
+
+    objects = tiered_cache.get_or_create_many(
+        "templated", "abc", ["page01.png", "page02.png", "page03.png"], mock_create
+    )
+
+    mock_create.assert_called_once_with(["page01.png", "page03.png"])
+    assert {extension: data.read() for extension, data in objects.items()} == {
+        "page01.png": b"page01.png",
+        "page02.png": b"cached",
+        "page03.png": b"page03.png",
+    }
+    assert {data.cache_digest for data in objects.values()} == {"abc"}
+    assert [call[0][3] for call in mocked_cache_set.call_args_list] == [
+        "test/templated/abc.page02.png",
+        "test/templated/abc.page01.png",
+        "test/templated/abc.page03.png",
+    ]
+
+    # everything is cached now, so it doesn't have to create anything
+    tiered_cache.get_or_create_many("templated", "abc", ["page01.png", "page03.png"], mock_create)
+    assert mock_create.call_count == 1
+
+
+def test_cache_returns_the_rendered_buffer_without_copying_it(app, client, mocked_cache_set):
+    rendered = BytesIO(b"rendered")
+
+    data = init_cache(app)("foo", folder="templated", extension="pdf")(lambda: rendered)()
+
+    assert data is rendered
+    assert data.read() == b"rendered"
+    mocked_cache_set.call_args[0][0].seek(0)
+    assert mocked_cache_set.call_args[0][0].read() == b"rendered"
+
+
+def test_cache_streams_s3_hits_to_disk_if_there_is_no_memory_tier(app, client, mocked_cache_get, tmp_path):
+    mocked_cache_get.side_effect = [s3_response_body(b"from s3")]
+
+    with set_config(app, "LETTER_CACHE_DISK_PATH", str(tmp_path)):
+        disk_only_cache = init_cache(app)
+
+    data = disk_only_cache("foo", folder="templated", extension="pdf")(lambda: BytesIO(b"rendered"))()
+
+    assert not isinstance(data, BytesIO)
+    assert data.read() == b"from s3"
+    assert [path.read_bytes() for path in (tmp_path / "test" / "templated").iterdir()] == [b"from s3"]
+
+
+def test_single_flight_tells_callers_if_they_had_to_wait():
+    single_flight = SingleFlight()
+    waited = []
+
+    def wait_for_lock():
+        with single_flight("key") as other_waited:
+            waited.append(other_waited)
+
+    with single_flight("key") as first_waited:
+        thread = threading.Thread(target=wait_for_lock)
+        thread.start()
+        thread.join(timeout=0.2)
+        assert thread.is_alive()
+
+    thread.join()
+    assert first_waited is False
+    assert waited == [True]
+
+
+def test_single_flight_does_not_block_different_keys():
+    single_flight = SingleFlight()
+
+    with single_flight("key"), single_flight("another-key") as waited:
+        assert waited is False
+
+
+def test_single_flight_coalesces_across_processes_with_a_lock_file(tmp_path):
+    # two instances don't share thread locks, like two gunicorn workers
+    single_flight = SingleFlight(lock_path=str(tmp_path))
+    other_process = SingleFlight(lock_path=str(tmp_path))
+    waited = []
+
+    def wait_for_lock():
+        with other_process("key") as other_waited:
+            waited.append(other_waited)
+
+    with single_flight("key"):
+        thread = threading.Thread(target=wait_for_lock)
+        thread.start()
+        thread.join(timeout=0.2)
+        assert thread.is_alive()
+
+    thread.join()
+    assert waited == [True]
+
+
+def test_single_flight_lock_files_dont_block_different_keys(tmp_path):
+    single_flight = SingleFlight(lock_path=str(tmp_path), timeout=5)
+    other_process = SingleFlight(lock_path=str(tmp_path), timeout=5)
+
+    with single_flight("key"):
+        for key in [f"another-key-{i}" for i in range(1000)]:
+            with single_flight(key) as waited, other_process(f"{key}-in-another-process") as other_waited:
+                assert waited is other_waited is False
+
+
+def test_single_flight_removes_lock_files_when_its_done(tmp_path):
+    single_flight = SingleFlight(lock_path=str(tmp_path))
+
+    with single_flight("key"):
+        assert len(list(tmp_path.iterdir())) == 1
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_single_flight_gives_up_waiting_after_timeout():
+    single_flight = SingleFlight(timeout=0.1)
+    waited = []
+
+    def wait_for_lock():
+        with single_flight("key") as other_waited:
+            waited.append(other_waited)
+
+    with single_flight("key"):
+        thread = threading.Thread(target=wait_for_lock)
+        thread.start()
+        thread.join(timeout=2)
+        assert not thread.is_alive()
+
+    assert waited == [True]
+
+
+def test_cache_only_renders_once_for_concurrent_misses(client, tiered_cache, mocked_cache_set):
+    rendering = threading.Event()
+    finish_rendering = threading.Event()
+    results = []
+
+    def _get():
+        rendering.set()
+        finish_rendering.wait(timeout=5)
+        return BytesIO(b"rendered")
+
+    def request_preview():
+        results.append(tiered_cache("foo", folder="templated", extension="pdf")(_get)().read())
+
+    threads = [threading.Thread(target=request_preview) for _ in range(3)]
+    threads[0].start()
+    rendering.wait(timeout=5)
+    for thread in threads[1:]:
+        thread.start()
+        thread.join(timeout=0.1)
+
+    finish_rendering.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [b"rendered"] * 3
+    assert mocked_cache_set.call_count == 1
+
+
+def test_cache_doesnt_take_a_lock_for_keys_that_dont_coalesce(
+    client, tiered_cache, mocked_cache_get, mocked_cache_set, mocker
+):
+    mock_single_flight = mocker.patch.object(tiered_cache, "single_flight")
+
+    data = tiered_cache("foo", folder="templated", extension="page-count", coalesce=False)(lambda: BytesIO(b"2"))()
+
+    assert data.read() == b"2"
+    assert not mock_single_flight.called
+    assert mocked_cache_set.call_count == 1
+
+
+def test_write_behind_uploader_uploads_in_the_background(app, mocker):
+    upload = mocker.Mock()
+    uploader = WriteBehindUploader(upload, app, max_queue_size=10)
+
+    uploader.put("templated/a.pdf", b"a")
+    uploader.put("templated/b.pdf", b"b")
+
+    assert uploader.drain(timeout=5) is True
+    assert upload.call_args_list == [
+        mocker.call("templated/a.pdf", b"a"),
+        mocker.call("templated/b.pdf", b"b"),
+    ]
+
+
+def test_write_behind_uploader_retries_failed_uploads(app, mocker):
+    upload = mocker.Mock(side_effect=[Exception("S3 is down"), None])
+    uploader = WriteBehindUploader(upload, app, max_queue_size=10, retry_delay=0)
+
+    uploader.put("templated/a.pdf", b"a")
+
+    assert uploader.drain(timeout=5) is True
+    assert upload.call_args_list == [mocker.call("templated/a.pdf", b"a")] * 2
+
+
+def test_write_behind_uploader_gives_up_after_max_attempts(app, mocker):
+    upload = mocker.Mock(side_effect=Exception("S3 is down"))
+    mock_incr = mocker.patch.object(app.statsd_client, "incr")
+    uploader = WriteBehindUploader(upload, app, max_queue_size=10, max_attempts=2, retry_delay=0)
+
+    uploader.put("templated/a.pdf", b"a")
+
+    assert uploader.drain(timeout=5) is True
+    assert upload.call_count == 2
+    assert mock_incr.call_args_list == [
+        mocker.call("letter-cache.write-behind.retried"),
+        mocker.call("letter-cache.write-behind.failed"),
+    ]
+
+
+def test_write_behind_uploader_drops_uploads_when_the_queue_is_full(app, mocker):
+    uploading = threading.Event()
+    finish_uploading = threading.Event()
+
+    def upload(cache_key, data):
+        uploading.set()
+        finish_uploading.wait(timeout=5)
+
+    upload = mocker.Mock(side_effect=upload)
+    mock_incr = mocker.patch.object(app.statsd_client, "incr")
+    uploader = WriteBehindUploader(upload, app, max_queue_size=1, put_timeout=0)
+
+    uploader.put("templated/a.pdf", b"a")
+    uploading.wait(timeout=5)
+    uploader.put("templated/b.pdf", b"b")
+    uploader.put("templated/c.pdf", b"c")
+
+    assert uploader.drain(timeout=0) is False
+
+    finish_uploading.set()
+    assert uploader.drain(timeout=5) is True
+    assert upload.call_args_list == [
+        mocker.call("templated/a.pdf", b"a"),
+        mocker.call("templated/b.pdf", b"b"),
+    ]
+    mock_incr.assert_called_once_with("letter-cache.write-behind.dropped")
+
+
+def test_cache_with_write_behind_returns_before_uploading(app, client, mocked_cache_set):
+    with set_config(app, "LETTER_CACHE_WRITE_BEHIND", True):
+        write_behind_cache = init_cache(app)
+
+    data = write_behind_cache("foo", folder="templated", extension="pdf")(lambda: BytesIO(b"rendered"))()
+
+    assert data.read() == b"rendered"
+    assert write_behind_cache.write_behind_uploader.drain(timeout=5) is True
+    mocked_cache_set.assert_called_once_with(mock.ANY, "eu-west-1", "test-template-preview-cache", mock.ANY)
+    assert mocked_cache_set.call_args[0][0].read() == b"rendered"
@@ -0,0 +1,112 @@
+import json
+from io import BytesIO
+
+import pytest
+
+from app.commands import prewarm_cache
+
+
+@pytest.fixture
+def payloads_file(tmp_path):
+    def _payloads_file(*lines):
+        path = tmp_path / "payloads.jsonl"
+        path.write_text("\n".join(lines))
+        return str(path)
+
+    return _payloads_file
+
+
+def test_prewarm_cache_renders_pdf_and_every_page(app, mocker, payloads_file, view_letter_template_request_data):
+    mock_prepare_pdf = mocker.patch("app.commands.prepare_pdf", return_value=BytesIO(b"pdf"))
+    mocker.patch("app.commands.get_page_count_for_pdf", return_value=2)
+    mock_get_pngs = mocker.patch("app.commands.get_pngs")
+
+    result = app.test_cli_runner().invoke(
+        prewarm_cache,
+        [payloads_file(json.dumps(view_letter_template_request_data)), "--concurrency", "1"],
+    )
+
+    assert result.exit_code == 0, result.output
+    mock_prepare_pdf.assert_called_once_with(view_letter_template_request_data)
+    assert list(mock_get_pngs.call_args[0][1]) == [1, 2]
+    assert "Pre-warmed 1 letters (2 pages)" in result.output
+    assert "0 failed" in result.output
+
+
+def test_prewarm_cache_renders_attachment_pages(app, mocker, payloads_file, view_letter_template_request_data):
+    view_letter_template_request_data["template"]["service"] = "1234"
+    view_letter_template_request_data["template"]["letter_attachment"] = {"id": "5678", "page_count": 2}
+    mocker.patch("app.commands.prepare_pdf", return_value=BytesIO(b"pdf"))
+    mocker.patch("app.commands.get_page_count_for_pdf", return_value=3)
+    mocker.patch("app.commands.get_pngs")
+    mock_get_attachment_png = mocker.patch("app.commands.get_attachment_png")
+
+    result = app.test_cli_runner().invoke(
+        prewarm_cache,
+        [payloads_file(json.dumps(view_letter_template_request_data)), "--concurrency", "1"],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert mock_get_attachment_png.call_args_list == [
+        mocker.call("1234", "5678", 1),
+        mocker.call("1234", "5678", 2),
+    ]
+
+
+def test_prewarm_cache_skips_attachments_without_a_service(
+    app, mocker, payloads_file, view_letter_template_request_data
+):
+    view_letter_template_request_data["template"].pop("service", None)
+    view_letter_template_request_data["template"]["letter_attachment"] = {"id": "5678", "page_count": 2}
+    mocker.patch("app.commands.prepare_pdf", return_value=BytesIO(b"pdf"))
+    mocker.patch("app.commands.get_page_count_for_pdf", return_value=3)
+    mock_get_pngs = mocker.patch("app.commands.get_pngs")
+    mock_get_attachment_png = mocker.patch("app.commands.get_attachment_png")
+
+    result = app.test_cli_runner(mix_stderr=False).invoke(
+        prewarm_cache,
+        [payloads_file(json.dumps(view_letter_template_request_data)), "--concurrency", "1"],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert mock_get_pngs.called
+    assert not mock_get_attachment_png.called
+    assert "Not pre-warming attachment 5678: its template has no service" in result.stderr
+    assert "Pre-warmed 1 letters (3 pages)" in result.stdout
+    assert "0 failed" in result.stdout
+
+
+def test_prewarm_cache_skips_invalid_lines_and_reports_failures(
+    app, mocker, payloads_file, view_letter_template_request_data
+):
+    mocker.patch("app.commands.prepare_pdf", side_effect=[BytesIO(b"pdf"), Exception("WeasyPrint fell over")])
+    mocker.patch("app.commands.get_page_count_for_pdf", return_value=1)
+    mocker.patch("app.commands.get_pngs")
+
+    result = app.test_cli_runner(mix_stderr=False).invoke(
+        prewarm_cache,
+        [
+            payloads_file(
+                json.dumps(view_letter_template_request_data),
+                "not json",
+                json.dumps({"template": {}}),
+                json.dumps(view_letter_template_request_data),
+            ),
+            "--concurrency",
+            "1",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Skipping line 2" in result.stderr
+    assert "Skipping line 3" in result.stderr
+    assert "Failed to pre-warm line 4" in result.stderr
+    assert "Pre-warmed 1 letters (1 pages)" in result.stdout
+    assert "1 failed" in result.stdout
+
+
+def test_prewarm_cache_errors_if_there_are_no_letters(app, payloads_file):
+    result = app.test_cli_runner().invoke(prewarm_cache, [payloads_file(""), "--concurrency", "1"])
+
+    assert result.exit_code == 1
+    assert "No letters to pre-warm" in result.output
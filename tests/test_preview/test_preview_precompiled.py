@@ -1,10 +1,36 @@
 from base64 import b64encode
 from io import BytesIO
 
+import fitz
 import pytest
 from flask import url_for
+from wand.color import Color
+from wand.exceptions import MissingDelegateError
+from wand.image import Image
+from werkzeug.exceptions import BadRequest
+
+from app.cache import cache_digest
+from app.preview import (
+    _png_compression_options,
+    extract_pages,
+    get_page_count_for_pdf,
+    page_sizes,
+    png_from_pdf,
+    pngs_from_pdf,
+)
+from tests.conftest import set_config
+from tests.pdf_consts import (
+    already_has_notify_tag,
+    cmyk_image_pdf,
+    multi_page_pdf,
+    not_pdf,
+    rgb_image_pdf,
+    valid_letter,
+)
 
-from tests.pdf_consts import multi_page_pdf, not_pdf, valid_letter
+# root mean square difference, from 0 for identical images to 1, that previews from each rasteriser can differ by.
+# Ghostscript and MuPDF anti-alias text differently, so they never quite match
+MAX_RASTERISER_DISTORTION = 0.05
 
 
 @pytest.mark.parametrize("filetype", ["pdf", "png"])
@@ -17,6 +43,13 @@ def test_preview_rejects_if_not_authenticated(client, filetype, headers):
     assert resp.status_code == 401
 
 
+def test_png_from_pdf_hides_notify_tag_with_a_white_block(client):
+    with Image(blob=png_from_pdf(already_has_notify_tag, 1, hide_notify=True)) as image:
+        image.alpha_channel = "remove"
+        for x, y in [(0, 0), (129, 0), (0, 49), (129, 49), (65, 25)]:
+            assert (image[x, y].red, image[x, y].green, image[x, y].blue) == (1, 1, 1)
+
+
 @pytest.mark.parametrize(
     "page_number, expected_response_code",
     [
@@ -68,6 +101,7 @@ def test_precompiled_pdf_caches_png_to_s3(
     mocked_cache_get,
     mocked_cache_set,
 ):
+    expected_cache_key = f"test/precompiled/{cache_digest(b64encode(valid_letter), False)}.page01.png"
     response = client.post(
         url_for("preview_blueprint.view_precompiled_letter"),
         data=b64encode(valid_letter),
@@ -79,13 +113,71 @@ def test_precompiled_pdf_caches_png_to_s3(
     assert response.get_data().startswith(b"\x89PNG")
     mocked_cache_get.assert_called_once_with(
         "test-template-preview-cache",
-        "precompiled/f9094f49cd156f0a5fb5082820fa4f396e082d88.page01.png",
+        expected_cache_key,
     )
     mocked_cache_set.call_args[0][0].seek(0)
     assert mocked_cache_set.call_args[0][0].read() == response.get_data()
     assert mocked_cache_set.call_args[0][1] == "eu-west-1"
     assert mocked_cache_set.call_args[0][2] == "test-template-preview-cache"
-    assert mocked_cache_set.call_args[0][3] == "precompiled/f9094f49cd156f0a5fb5082820fa4f396e082d88.page01.png"
+    assert mocked_cache_set.call_args[0][3] == expected_cache_key
+
+
+@pytest.mark.parametrize(
+    "params, expected_extension, expected_mimetype, expected_width",
+    [
+        ({"dpi": "36"}, "page01.36dpi.png", "image/png", 298),
+        ({"width": "298"}, "page01.36dpi.png", "image/png", 298),
+        ({"format": "webp"}, "page01.150dpi.webp", "image/webp", 1240),
+        ({"dpi": "36", "format": "webp"}, "page01.36dpi.webp", "image/webp", 298),
+    ],
+)
+def test_precompiled_pdf_returns_smaller_images_or_webp(
+    app,
+    client,
+    auth_header,
+    mocked_cache_get,
+    mocked_cache_set,
+    params,
+    expected_extension,
+    expected_mimetype,
+    expected_width,
+):
+    response = client.post(
+        url_for("preview_blueprint.view_precompiled_letter", **params),
+        data=b64encode(valid_letter),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == expected_mimetype
+    with Image(blob=response.get_data()) as image:
+        assert abs(image.width - expected_width) <= 1
+    assert mocked_cache_set.call_args[0][3] == (
+        f"test/precompiled/{cache_digest(b64encode(valid_letter), False)}.{expected_extension}"
+    )
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"format": "avif"},
+        {"dpi": "9"},
+        {"dpi": "300"},
+        {"dpi": "seventy-two"},
+        {"width": "2000"},
+    ],
+)
+def test_precompiled_pdf_rejects_unsupported_sizes_and_formats(client, auth_header, mocker, params):
+    mock_png_from_pdf = mocker.patch("app.preview.png_from_pdf")
+
+    response = client.post(
+        url_for("preview_blueprint.view_precompiled_letter", **params),
+        data=b64encode(valid_letter),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert response.status_code == 400
+    assert not mock_png_from_pdf.called
 
 
 def test_precompiled_pdf_returns_png_from_cache(
@@ -95,6 +187,7 @@ def test_precompiled_pdf_returns_png_from_cache(
     mocked_cache_get,
     mocked_cache_set,
 ):
+    expected_cache_key = f"test/precompiled/{cache_digest(b64encode(valid_letter), False)}.page01.png"
     mocked_cache_get.side_effect = None
     mocked_cache_get.return_value = BytesIO(b"\x00")
 
@@ -109,7 +202,7 @@ def test_precompiled_pdf_returns_png_from_cache(
     assert response.get_data() == b"\x00"
     mocked_cache_get.assert_called_once_with(
         "test-template-preview-cache",
-        "precompiled/f9094f49cd156f0a5fb5082820fa4f396e082d88.page01.png",
+        expected_cache_key,
     )
     assert mocked_cache_set.call_args_list == []
 
@@ -156,7 +249,7 @@ def test_precompiled_cmyk_colourspace_calls_transform_colorspace(
         headers={"Content-type": "application/json", **auth_header},
     )
 
-    mock_transform.assert_called_with("cmyk")
+    mock_transform.assert_called_once_with("srgb")
 
 
 def test_precompiled_rgb_colourspace_does_not_call_transform_colorspace(
@@ -223,3 +316,209 @@ def test_precompiled_not_pdf_get_image_by_page_raises_400(
     )
 
     assert response.status_code == 400
+
+
+def test_precompiled_preview_remembers_files_it_cant_read(client, auth_header, mocker, negative_cache):
+    mock_png_from_pdf = mocker.patch("app.preview.png_from_pdf", side_effect=MissingDelegateError("not a pdf"))
+
+    for _ in range(2):
+        response = client.post(
+            url_for("preview_blueprint.view_precompiled_letter", page=1),
+            data=b64encode(not_pdf),
+            headers={"Content-type": "application/json", **auth_header},
+        )
+        assert response.status_code == 400
+
+    assert mock_png_from_pdf.call_count == 1
+
+
+def test_extract_pages_returns_a_pdf_with_just_those_pages():
+    with fitz.open(stream=multi_page_pdf, filetype="pdf") as document:
+        expected_text = [document[6].get_text(), document[2].get_text()]
+
+    with fitz.open(stream=extract_pages(multi_page_pdf, [7, 3]), filetype="pdf") as document:
+        assert [page.get_text() for page in document] == expected_text
+
+
+@pytest.mark.parametrize("page_number", [0, 11])
+def test_extract_pages_raises_if_page_doesnt_exist(page_number):
+    with pytest.raises(IndexError):
+        extract_pages(multi_page_pdf, [1, page_number])
+
+
+@pytest.fixture
+def mixed_page_size_pdf():
+    with fitz.open() as document:
+        document.new_page(width=595.28, height=841.89)
+        document.new_page(width=420.94, height=595.28)
+        document.new_page(width=595.28, height=841.89)
+        return document.tobytes()
+
+
+def test_page_sizes_makes_pages_the_size_of_page_1(mixed_page_size_pdf):
+    assert page_sizes(mixed_page_size_pdf, [3, 2]) == [None, (1240, 1754)]
+    assert page_sizes(mixed_page_size_pdf, [2], dpi=72) == [(595, 842)]
+
+
+def test_pngs_from_pdf_pads_pages_the_same_whichever_pages_are_rasterised_together(client, mixed_page_size_pdf):
+    (alone,) = pngs_from_pdf(mixed_page_size_pdf, [2])
+    _, with_page_1 = pngs_from_pdf(mixed_page_size_pdf, [1, 2])
+
+    with Image(blob=alone) as alone_image, Image(blob=with_page_1) as with_page_1_image:
+        assert alone_image.size == with_page_1_image.size == (1240, 1754)
+        assert alone_image.signature == with_page_1_image.signature
+
+
+@pytest.mark.parametrize("page_number", [1, 10])
+def test_png_from_pdf_renders_the_same_page_as_rasterising_the_whole_pdf(client, mocker, page_number):
+    single_page_png = png_from_pdf(multi_page_pdf, page_number=page_number)
+    mocker.patch("app.preview.extract_pages", side_effect=Exception("Couldn't open PDF"))
+    whole_pdf_png = png_from_pdf(multi_page_pdf, page_number=page_number)
+
+    with Image(blob=single_page_png) as single_page_image, Image(blob=whole_pdf_png) as whole_pdf_image:
+        assert single_page_image.signature == whole_pdf_image.signature
+
+
+def test_png_from_pdf_only_gives_imagemagick_the_requested_page(client, mocker):
+    mock_image = mocker.patch("app.preview.Image", wraps=Image)
+
+    png_from_pdf(BytesIO(multi_page_pdf), page_number=3)
+
+    with fitz.open(stream=mock_image.call_args_list[0][1]["blob"], filetype="pdf") as document:
+        assert document.page_count == 1
+
+
+def test_pngs_from_pdf_renders_the_same_pages_as_png_from_pdf(client, mocker):
+    mock_image = mocker.patch("app.preview.Image", wraps=Image)
+
+    pngs = pngs_from_pdf(multi_page_pdf, [2, 5])
+
+    # one session for the PDF, and one for each page it's composited onto
+    assert mock_image.call_count == 3
+    for page_number, png in zip([2, 5], pngs, strict=True):
+        with Image(blob=png) as batch_image, Image(blob=png_from_pdf(multi_page_pdf, page_number)) as single_image:
+            assert batch_image.signature == single_image.signature
+
+
+def _flattened(png):
+    image = Image(blob=png.read())
+    image.background_color = Color("white")
+    image.alpha_channel = "remove"
+    return image
+
+
+@pytest.mark.parametrize(
+    "pdf, page_number, hide_notify",
+    [
+        (valid_letter, 1, False),
+        (valid_letter, 1, True),
+        (multi_page_pdf, 10, False),
+        (rgb_image_pdf, 1, False),
+        (cmyk_image_pdf, 1, False),
+    ],
+)
+def test_pymupdf_rasteriser_looks_the_same_as_wand(app, client, pdf, page_number, hide_notify):
+    wand_png = png_from_pdf(pdf, page_number, hide_notify=hide_notify)
+    with set_config(app, "PREVIEW_RASTERISER", "pymupdf"):
+        pymupdf_png = png_from_pdf(pdf, page_number, hide_notify=hide_notify)
+
+    with _flattened(wand_png) as wand_image, _flattened(pymupdf_png) as pymupdf_image:
+        # the rasterisers round the page size to whole pixels differently
+        assert abs(wand_image.width - pymupdf_image.width) <= 1
+        assert abs(wand_image.height - pymupdf_image.height) <= 1
+        width, height = min(wand_image.width, pymupdf_image.width), min(wand_image.height, pymupdf_image.height)
+        wand_image.crop(width=width, height=height)
+        pymupdf_image.crop(width=width, height=height)
+
+        _, distortion = wand_image.compare(pymupdf_image, metric="root_mean_square")
+        assert distortion < MAX_RASTERISER_DISTORTION
+
+
+@pytest.mark.parametrize("rasteriser", ["wand", "pymupdf"])
+def test_png_compression_level_zero_doesnt_compress_pngs(app, client, rasteriser):
+    with set_config(app, "PREVIEW_RASTERISER", rasteriser):
+        compressed = png_from_pdf(valid_letter, 1).read()
+        with set_config(app, "PREVIEW_PNG_COMPRESSION_LEVEL", 0):
+            uncompressed = png_from_pdf(valid_letter, 1).read()
+
+    assert len(uncompressed) > 10 * len(compressed)
+    with Image(blob=compressed) as compressed_image, Image(blob=uncompressed) as uncompressed_image:
+        assert compressed_image.signature == uncompressed_image.signature
+
+
+@pytest.mark.parametrize(
+    "level, png_filter, compression, expected_options",
+    [
+        (None, None, "default", {}),
+        (0, None, "default", {"png:compression-level": "0"}),
+        (1, 5, "default", {"png:compression-level": "1", "png:compression-filter": "5"}),
+        (None, None, "none", {"png:compression-level": "0"}),
+        (9, 5, "none", {"png:compression-level": "0"}),
+    ],
+)
+def test_png_compression_options(app, client, level, png_filter, compression, expected_options):
+    with (
+        set_config(app, "PREVIEW_PNG_COMPRESSION_LEVEL", level),
+        set_config(app, "PREVIEW_PNG_COMPRESSION_FILTER", png_filter),
+    ):
+        assert _png_compression_options(compression) == expected_options
+
+
+@pytest.mark.parametrize("rasteriser", ["wand", "pymupdf"])
+def test_pngs_from_pdf_doesnt_compress_pngs_if_asked_not_to(app, client, rasteriser):
+    with set_config(app, "PREVIEW_RASTERISER", rasteriser), set_config(app, "PREVIEW_PNG_COMPRESSION_LEVEL", 9):
+        compressed = png_from_pdf(valid_letter, 1).read()
+        uncompressed = png_from_pdf(valid_letter, 1, compression="none").read()
+
+    assert len(uncompressed) > 10 * len(compressed)
+
+
+@pytest.mark.parametrize("rasteriser", ["wand", "pymupdf"])
+def test_pngs_from_pdf_can_make_smaller_webp_images(app, client, rasteriser):
+    with set_config(app, "PREVIEW_RASTERISER", rasteriser):
+        (webp,) = pngs_from_pdf(already_has_notify_tag, [1], hide_notify=True, dpi=36, image_format="webp")
+
+    with Image(blob=webp.read()) as image:
+        assert image.format == "WEBP"
+        assert abs(image.width - 298) <= 1
+        # the NOTIFY tag is covered by a block a quarter of the usual size
+        image.alpha_channel = "remove"
+        assert (image[30, 11].red, image[30, 11].green, image[30, 11].blue) == (1, 1, 1)
+
+
+def test_pymupdf_rasteriser_doesnt_use_imagemagick(app, client, mocker):
+    mock_image = mocker.patch("app.preview.Image")
+
+    with set_config(app, "PREVIEW_RASTERISER", "pymupdf"):
+        pngs = pngs_from_pdf(BytesIO(multi_page_pdf), [3, 1])
+
+    assert not mock_image.called
+    assert [png.read(8) for png in pngs] == [b"\x89PNG\r\n\x1a\n"] * 2
+
+
+@pytest.mark.parametrize("page_number", [0, 11])
+def test_pymupdf_rasteriser_rejects_pages_that_dont_exist(app, client, page_number):
+    with set_config(app, "PREVIEW_RASTERISER", "pymupdf"), pytest.raises(BadRequest):
+        png_from_pdf(multi_page_pdf, page_number)
+
+
+def test_pymupdf_rasteriser_falls_back_to_wand_for_files_it_cant_open(app, client, mocker):
+    mock_wand = mocker.patch("app.preview._pngs_from_pdf_with_wand", return_value=[BytesIO(b"png")])
+
+    with set_config(app, "PREVIEW_RASTERISER", "pymupdf"):
+        assert png_from_pdf(not_pdf, 1).read() == b"png"
+
+    mock_wand.assert_called_once_with(not_pdf, [1], False, 150, "png", "default")
+
+
+@pytest.mark.parametrize("pdf, expected_page_count", [(valid_letter, 1), (BytesIO(multi_page_pdf), 10)])
+def test_get_page_count_for_pdf_doesnt_rasterise_the_pdf(mocker, pdf, expected_page_count):
+    mocker.patch("app.preview.Image", side_effect=AssertionError("Shouldn’t rasterise the PDF"))
+
+    assert get_page_count_for_pdf(pdf) == expected_page_count
+
+
+def test_get_page_count_for_pdf_falls_back_to_rasterising_if_it_cant_read_the_page_tree(client, mocker):
+    mocker.patch("app.preview.fitz.open", side_effect=RuntimeError("Couldn't open PDF"))
+
+    assert get_page_count_for_pdf(multi_page_pdf) == 10
@@ -1,5 +1,6 @@
 import json
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from unittest.mock import Mock, patch
 
@@ -9,7 +10,9 @@ from flask_weasyprint import HTML
 from freezegun import freeze_time
 from notifications_utils.s3 import S3ObjectNotFound
 
-from app.preview import get_html
+from app import init_cache
+from app.cache import cache_digest
+from app.preview import get_html, get_preview_etag
 from tests.conftest import s3_response_body, set_config
 from tests.pdf_consts import cmyk_and_rgb_images_in_one_pdf, multi_page_pdf, valid_letter
 
@@ -117,10 +120,11 @@ def test_get_pdf_caches_with_correct_keys(
     app,
     mocker,
     view_letter_template_pdf,
+    view_letter_template_request_data,
     mocked_cache_get,
     mocked_cache_set,
 ):
-    expected_cache_key = "templated/d0a9992bafc3669a8104aec93d89e4bc7dca4cb1.pdf"
+    expected_cache_key = f"test/templated/{cache_digest(get_html(view_letter_template_request_data))}.pdf"
     resp = view_letter_template_pdf()
 
     assert resp.status_code == 200
@@ -140,10 +144,12 @@ def test_get_png_caches_with_correct_keys(
     app,
     mocker,
     view_letter_template_png,
+    view_letter_template_request_data,
     mocked_cache_get,
     mocked_cache_set,
 ):
-    expected_cache_key = "templated/cfa8aaad30c73e8c98fcf09a29ac6523a624fe00.page01.png"
+    # the png is keyed on the digest of the pdf it's rendered from
+    expected_cache_key = f"test/templated/{cache_digest(get_html(view_letter_template_request_data))}.page01.png"
     resp = view_letter_template_png()
 
     assert resp.status_code == 200
@@ -161,6 +167,89 @@ def test_get_png_caches_with_correct_keys(
     assert mocked_cache_set.call_args_list[1][0][3] == expected_cache_key
 
 
+def test_get_png_caches_smaller_webp_images_with_their_own_keys(
+    app,
+    client,
+    auth_header,
+    view_letter_template_request_data,
+    mocked_cache_get,
+    mocked_cache_set,
+):
+    expected_cache_key = f"test/templated/{cache_digest(get_html(view_letter_template_request_data))}.page01.72dpi.webp"
+
+    resp = client.post(
+        url_for("preview_blueprint.view_letter_template_png", dpi=72, format="webp"),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert resp.status_code == 200
+    assert resp.headers["Content-Type"] == "image/webp"
+    assert resp.get_data()[8:12] == b"WEBP"
+    assert mocked_cache_get.call_args_list[1][0][1] == expected_cache_key
+    assert mocked_cache_set.call_args_list[1][0][3] == expected_cache_key
+
+
+def test_get_png_caches_pngs_with_other_compression_settings_with_their_own_keys(
+    app,
+    client,
+    auth_header,
+    view_letter_template_request_data,
+    mocked_cache_get,
+    mocked_cache_set,
+):
+    digest = cache_digest(get_html(view_letter_template_request_data))
+    expected_cache_key = f"test/templated/{digest}.page01.150dpi.level1.filter5.png"
+
+    with (
+        set_config(app, "PREVIEW_PNG_COMPRESSION_LEVEL", 1),
+        set_config(app, "PREVIEW_PNG_COMPRESSION_FILTER", 5),
+    ):
+        resp = client.post(
+            url_for("preview_blueprint.view_letter_template_png"),
+            data=json.dumps(view_letter_template_request_data),
+            headers={"Content-type": "application/json", **auth_header},
+        )
+
+    assert resp.status_code == 200
+    assert mocked_cache_get.call_args_list[1][0][1] == expected_cache_key
+    assert mocked_cache_set.call_args_list[1][0][3] == expected_cache_key
+
+
+def test_get_png_doesnt_cache_uncompressed_pngs(
+    client,
+    auth_header,
+    view_letter_template_request_data,
+    mocked_cache_get,
+    mocked_cache_set,
+):
+    resp = client.post(
+        url_for("preview_blueprint.view_letter_template_png", compression="none"),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert resp.status_code == 200
+    assert resp.get_data().startswith(b"\x89PNG")
+    # only the PDF is cached
+    assert mocked_cache_get.call_count == 1
+    assert mocked_cache_set.call_count == 1
+    assert mocked_cache_set.call_args[0][3].endswith(".pdf")
+
+
+@pytest.mark.parametrize("params", [{"compression": "fast"}, {"compression": "none", "format": "webp"}])
+def test_view_letter_template_png_rejects_invalid_compression(
+    client, auth_header, view_letter_template_request_data, params
+):
+    resp = client.post(
+        url_for("preview_blueprint.view_letter_template_png", **params),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert resp.status_code == 400
+
+
 @pytest.mark.parametrize(
     "cache_get_returns, number_of_cache_get_calls, number_of_cache_set_calls",
     [
@@ -408,6 +497,69 @@ def test_view_letter_template_png_route_gets_png_for_page(
     assert not mocked_hide_notify.called
 
 
+@pytest.mark.parametrize(
+    "pages, expected_pages",
+    [
+        ({}, ["1", "2"]),
+        ({"pages": "2"}, ["2"]),
+        ({"pages": "2,1,2"}, ["2", "1"]),
+    ],
+)
+def test_view_letter_template_pngs_returns_requested_pages(
+    client, auth_header, mocker, view_letter_template_request_data, pages, expected_pages
+):
+    view_letter_template_request_data["template"]["content"] = "All work and no play makes Jack a dull boy. " * 50
+    mock_pngs_from_pdf = mocker.patch(
+        "app.preview.pngs_from_pdf",
+        side_effect=lambda pdf, page_numbers, **kwargs: [BytesIO(b"png") for _ in page_numbers],
+    )
+
+    response = client.post(
+        url_for("preview_blueprint.view_letter_template_pngs", **pages),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert response.status_code == 200
+    assert response.json["page_count"] == 2
+    assert list(response.json["pages"]) == expected_pages
+    assert set(response.json["pages"].values()) == {"cG5n"}
+    # all the pages are rasterised together
+    assert mock_pngs_from_pdf.call_count == 1
+
+
+@pytest.mark.parametrize("pages", ["3", "0", "1,two", ""])
+def test_view_letter_template_pngs_rejects_invalid_pages(client, auth_header, view_letter_template_request_data, pages):
+    response = client.post(
+        url_for("preview_blueprint.view_letter_template_pngs", pages=pages),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert response.status_code == 400
+
+
+def test_view_letter_template_pngs_caches_each_page_like_preview_png(
+    app, client, auth_header, mocker, view_letter_template_png, view_letter_template_request_data
+):
+    with set_config(app, "LETTER_CACHE_MEMORY_MAX_BYTES", 1024 * 1024):
+        mocker.patch.object(app, "cache", init_cache(app))
+    mock_pngs_from_pdf = mocker.patch("app.preview.pngs_from_pdf", return_value=[BytesIO(b"png")])
+    mock_png_from_pdf = mocker.patch("app.preview.png_from_pdf")
+
+    pages_response = client.post(
+        url_for("preview_blueprint.view_letter_template_pngs"),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+    png_response = view_letter_template_png()
+
+    assert pages_response.status_code == png_response.status_code == 200
+    assert png_response.get_data() == b"png"
+    assert mock_pngs_from_pdf.call_count == 1
+    assert not mock_png_from_pdf.called
+
+
 def test_view_letter_template_for_letter_attachment(
     client,
     auth_header,
@@ -486,6 +638,59 @@ def test_preview_for_letter_attachment(
     assert response.mimetype == "image/png"
 
 
+def test_preview_for_letter_attachment_as_webp(client, auth_header, mocker):
+    mock_get_attachment_png = mocker.patch(
+        "app.preview.get_attachment_png", return_value=BytesIO(b"RIFF\x00\x00\x00\x00WEBP")
+    )
+
+    response = client.post(
+        url_for("preview_blueprint.view_letter_attachment_preview", page=1, width=372, format="webp"),
+        data=json.dumps({"service_id": "123", "letter_attachment_id": "5678"}),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+    mock_get_attachment_png.assert_called_once_with(
+        "123", "5678", 1, dpi=45, image_format="webp", compression="default"
+    )
+
+
+def test_preview_for_letter_attachment_is_cached_by_id(client, auth_header, mocker, mocked_cache_get, mocked_cache_set):
+    expected_cache_key = f"test/attachments/{cache_digest('123', '5678')}.page01.png"
+    mock_s3download_attachment_file = mocker.patch(
+        "app.letter_attachments.s3download", return_value=BytesIO(valid_letter)
+    )
+
+    response = client.post(
+        url_for("preview_blueprint.view_letter_attachment_preview", page=1),
+        data=json.dumps({"service_id": "123", "letter_attachment_id": "5678"}),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert response.status_code == 200
+    assert mock_s3download_attachment_file.call_count == 1
+    mocked_cache_get.assert_called_once_with("test-template-preview-cache", expected_cache_key)
+    assert mocked_cache_set.call_args[0][3] == expected_cache_key
+
+
+def test_preview_for_letter_attachment_doesnt_download_attachment_on_cache_hit(
+    client, auth_header, mocker, mocked_cache_get
+):
+    mocked_cache_get.side_effect = [s3_response_body(b"png")]
+    mock_s3download_attachment_file = mocker.patch("app.letter_attachments.s3download")
+
+    response = client.post(
+        url_for("preview_blueprint.view_letter_attachment_preview", page=1),
+        data=json.dumps({"service_id": "123", "letter_attachment_id": "5678"}),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert response.status_code == 200
+    assert response.get_data() == b"png"
+    assert not mock_s3download_attachment_file.called
+
+
 @pytest.mark.parametrize("letter_attachment, requested_page", [(None, 2), ({"page_count": 1, "id": "1234"}, 3)])
 def test_view_letter_attachment_preview_when_requested_page_out_of_range(
     client, auth_header, mocker, letter_attachment, requested_page
@@ -544,6 +749,75 @@ def test_view_letter_template_png_when_requested_page_out_of_range(
     assert response.json["message"] == f"400 Bad Request: Letter does not have a page {requested_page}"
 
 
+@pytest.mark.parametrize("endpoint", ["view_letter_template_pdf", "view_letter_template_png"])
+def test_preview_returns_304_if_etag_matches_without_rendering(
+    client, auth_header, mocker, view_letter_template_request_data, endpoint
+):
+    first_response = client.post(
+        url_for(f"preview_blueprint.{endpoint}"),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+    mock_prepare_pdf = mocker.patch("app.preview.prepare_pdf")
+
+    second_response = client.post(
+        url_for(f"preview_blueprint.{endpoint}"),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", "If-None-Match": first_response.headers["ETag"], **auth_header},
+    )
+
+    assert first_response.status_code == 200
+    assert second_response.status_code == 304
+    assert second_response.headers["ETag"] == first_response.headers["ETag"]
+    assert second_response.get_data() == b""
+    assert not mock_prepare_pdf.called
+
+
+@pytest.mark.parametrize(
+    "changes, params",
+    [
+        ({"values": {"name": "Jo"}}, {}),
+        ({"date": "2012-12-13T00:00:00"}, {}),
+        ({}, {"page": 2}),
+        ({}, {"format": "webp"}),
+        ({}, {"dpi": 72}),
+        ({}, {"compression": "none"}),
+    ],
+)
+@freeze_time("2012-12-12")
+def test_preview_png_etag_changes_with_the_letter_and_image(
+    client, auth_header, mocker, view_letter_template_request_data, changes, params
+):
+    mock_get_png_preview_for_pdf = mocker.patch(
+        "app.preview.get_png_preview_for_pdf", side_effect=lambda *args, **kwargs: current_app.response_class(b"png")
+    )
+    mocker.patch("app.preview.prepare_pdf")
+
+    def _etag(data, **params):
+        return client.post(
+            url_for("preview_blueprint.view_letter_template_png", **params),
+            data=json.dumps(data),
+            headers={"Content-type": "application/json", **auth_header},
+        ).headers["ETag"]
+
+    assert _etag(view_letter_template_request_data) != _etag({**view_letter_template_request_data, **changes}, **params)
+    assert mock_get_png_preview_for_pdf.call_count == 2
+
+
+def test_preview_etag_changes_with_the_date_for_undated_letters(client, view_letter_template_request_data):
+    with freeze_time("2012-12-12"):
+        etag = get_preview_etag(view_letter_template_request_data, "pdf")
+    with freeze_time("2012-12-13"):
+        assert get_preview_etag(view_letter_template_request_data, "pdf") != etag
+
+
+@pytest.mark.parametrize("setting", ["PREVIEW_PNG_COMPRESSION_LEVEL", "PREVIEW_PNG_COMPRESSION_FILTER"])
+def test_preview_etag_changes_with_png_compression_settings(app, client, view_letter_template_request_data, setting):
+    etag = get_preview_etag(view_letter_template_request_data, "png")
+    with set_config(app, setting, 1):
+        assert get_preview_etag(view_letter_template_request_data, "png") != etag
+
+
 def test_letter_template_constructed_properly_for_pdf(view_letter_template_request_data, view_letter_template_pdf):
     with patch("app.preview.LetterPreviewTemplate", __str__=Mock(return_value="foo")) as mock_template:
         resp = view_letter_template_pdf()
@@ -683,33 +957,71 @@ def test_POST_page_count(
     }
 
 
+def test_page_count_renders_languages_in_parallel_with_a_render_pool(app, client, auth_header, mocker, tmp_path):
+    mock_page_count = mocker.patch(
+        "app.preview._preview_and_get_page_count",
+        side_effect=lambda json, language="english": {"welsh": 2, "english": 3}[language],
+    )
+    mock_executor = mocker.patch("app.templated.ThreadPoolExecutor", wraps=ThreadPoolExecutor)
+    data = {
+        "letter_contact_block": "123",
+        "template": {
+            "id": str(uuid.uuid4()),
+            "subject": "letter subject",
+            "content": "letter content",
+            "template_type": "letter",
+            "version": 1,
+            "service": "1234",
+            "letter_languages": "welsh_then_english",
+            "letter_welsh_subject": "Da iawn",
+            "letter_welsh_content": "Cathod yn neis",
+        },
+        "values": {},
+        "filename": "hm-government",
+    }
+
+    with set_config(app, "RENDER_POOL_SOCKET_PATH", str(tmp_path / "render.sock")):
+        response = client.post(
+            url_for("preview_blueprint.page_count"),
+            data=json.dumps(data),
+            headers={"Content-type": "application/json", **auth_header},
+        )
+
+    assert response.json == {"count": 5, "attachment_page_count": 0, "welsh_page_count": 2}
+    assert sorted(call.kwargs.get("language", "english") for call in mock_page_count.call_args_list) == [
+        "english",
+        "welsh",
+    ]
+    mock_executor.assert_called_once_with(max_workers=2)
+
+
 @freeze_time("2012-12-12")
 def test_page_count_from_cache(client, auth_header, mocker, mocked_cache_get):
-    mocked_cache_get.side_effect = [s3_response_body(multi_page_pdf)]
+    # page count isn't cached, but the pdf is
+    mocked_cache_get.side_effect = [S3ObjectNotFound({}, ""), s3_response_body(multi_page_pdf)]
     mocker.patch(
         "app.preview.HTML",
         side_effect=AssertionError("Uncached method shouldn’t be called"),
     )
+    data = {
+        "letter_contact_block": "123",
+        "template": {
+            "id": str(uuid.uuid4()),
+            "template_type": "letter",
+            "subject": "letter subject",
+            "content": " letter content",
+            "letter_attachment": None,
+        },
+        "values": {},
+        "filename": "hm-government",
+    }
     response = client.post(
         url_for("preview_blueprint.page_count"),
-        data=json.dumps(
-            {
-                "letter_contact_block": "123",
-                "template": {
-                    "id": str(uuid.uuid4()),
-                    "template_type": "letter",
-                    "subject": "letter subject",
-                    "content": " letter content",
-                    "letter_attachment": None,
-                },
-                "values": {},
-                "filename": "hm-government",
-            }
-        ),
+        data=json.dumps(data),
         headers={"Content-type": "application/json", **auth_header},
     )
     assert mocked_cache_get.call_args[0][0] == "test-template-preview-cache"
-    assert mocked_cache_get.call_args[0][1] == "templated/03ba71054b80b0ffc758d3b228784d1bfb8c0ca3.pdf"
+    assert mocked_cache_get.call_args[0][1] == f"test/templated/{cache_digest(get_html(data))}.pdf"
     assert response.status_code == 200
     assert json.loads(response.get_data(as_text=True)) == {
         "count": 10,
@@ -718,6 +1030,49 @@ def test_page_count_from_cache(client, auth_header, mocker, mocked_cache_get):
     }
 
 
+@freeze_time("2012-12-12")
+def test_page_count_from_page_count_cache(
+    client, auth_header, mocker, mocked_cache_get, mocked_cache_set, view_letter_template_request_data
+):
+    mocked_cache_get.side_effect = [s3_response_body(b"10")]
+    mocker.patch("app.preview.HTML", side_effect=AssertionError("Uncached method shouldn’t be called"))
+    mocker.patch(
+        "app.preview.get_page_count_for_pdf", side_effect=AssertionError("Uncached method shouldn’t be called")
+    )
+
+    response = client.post(
+        url_for("preview_blueprint.page_count"),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    assert response.status_code == 200
+    assert response.json == {"count": 10, "attachment_page_count": 0, "welsh_page_count": 0}
+    mocked_cache_get.assert_called_once_with(
+        "test-template-preview-cache",
+        f"test/templated/{cache_digest(get_html(view_letter_template_request_data))}.page-count",
+    )
+    assert not mocked_cache_set.called
+
+
+@freeze_time("2012-12-12")
+def test_page_count_caches_page_count(client, auth_header, mocker, mocked_cache_set, view_letter_template_request_data):
+    mocker.patch("app.preview.get_page_count_for_pdf", return_value=2)
+
+    client.post(
+        url_for("preview_blueprint.page_count"),
+        data=json.dumps(view_letter_template_request_data),
+        headers={"Content-type": "application/json", **auth_header},
+    )
+
+    digest = cache_digest(get_html(view_letter_template_request_data))
+    assert [call[0][3] for call in mocked_cache_set.call_args_list] == [
+        f"test/templated/{digest}.pdf",
+        f"test/templated/{digest}.page-count",
+    ]
+    assert mocked_cache_set.call_args_list[1][0][0].read() == b"2"
+
+
 def test_returns_500_if_logo_not_found_for_view_letter_template_pdf(app, view_letter_template_pdf):
     with set_config(app, "LETTER_LOGO_URL", "https://not-a-real-website/"):
         response = view_letter_template_pdf()
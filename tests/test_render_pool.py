@@ -0,0 +1,125 @@
+import socket
+import threading
+
+import pytest
+
+from app.render_pool import (
+    HTML,
+    STATUS_OK,
+    PooledHTML,
+    RenderPool,
+    RenderPoolError,
+    receive_message,
+    render_pdf,
+    send_message,
+)
+from app.weasyprint_hack import LetterHTML, WeasyprintError
+from tests.conftest import set_config
+
+
+@pytest.fixture
+def render_pool(app, tmp_path):
+    """
+    A pool that answers jobs on a socket from a thread in this process, rather than forking workers
+    """
+    socket_path = str(tmp_path / "render.sock")
+    pool = RenderPool(app, socket_path, processes=1, max_rss_bytes=1024 * 1024 * 1024)
+    pool.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    pool.listener.bind(socket_path)
+    pool.listener.listen(1)
+
+    def answer_one_job():
+        connection, _ = pool.listener.accept()
+        with connection:
+            pool.handle(connection)
+
+    thread = threading.Thread(target=answer_one_job)
+    thread.start()
+    yield pool
+    thread.join(timeout=5)
+    pool.listener.close()
+
+
+def test_messages_round_trip():
+    left, right = socket.socketpair()
+    with left, right:
+        send_message(left, STATUS_OK, b"%PDF" * 100_000)
+
+        assert receive_message(right) == (STATUS_OK, b"%PDF" * 100_000)
+
+
+def test_receive_message_raises_if_the_connection_closes_mid_message():
+    left, right = socket.socketpair()
+    with right:
+        left.sendall(STATUS_OK + b"\x00\x00\x00\x10%PDF")
+        left.close()
+
+        with pytest.raises(ConnectionResetError):
+            receive_message(right)
+
+
+def test_render_pool_renders_letters(render_pool, mocker):
+    mock_html = mocker.patch("app.render_pool.LetterHTML")
+    mock_html.return_value.write_pdf.return_value = b"%PDF"
+
+    pdf = render_pdf(render_pool.socket_path, "<p>Hello</p>", "http://localhost/preview.pdf", timeout=5)
+
+    assert pdf == b"%PDF"
+    mock_html.assert_called_once_with("<p>Hello</p>")
+
+
+def test_render_pool_passes_weasyprint_errors_back(render_pool, mocker):
+    mock_html = mocker.patch("app.render_pool.LetterHTML")
+    mock_html.return_value.write_pdf.side_effect = WeasyprintError("Failed to load image at logo.svg")
+
+    with pytest.raises(WeasyprintError) as exc:
+        render_pdf(render_pool.socket_path, "<p>Hello</p>", "http://localhost/", timeout=5)
+
+    assert str(exc.value) == "Failed to load image at logo.svg"
+
+
+def test_render_pool_passes_other_errors_back(render_pool, mocker):
+    mocker.patch("app.render_pool.LetterHTML", side_effect=ValueError("bad letter"))
+
+    with pytest.raises(RenderPoolError) as exc:
+        render_pdf(render_pool.socket_path, "<p>Hello</p>", "http://localhost/", timeout=5)
+
+    assert str(exc.value) == "ValueError('bad letter')"
+
+
+def test_html_renders_in_process_without_a_render_pool(app):
+    with app.test_request_context(""):
+        assert isinstance(HTML("<p>Hello</p>"), LetterHTML)
+
+
+def test_html_renders_in_the_render_pool_if_there_is_one(app, render_pool, mocker):
+    mock_html = mocker.patch("app.render_pool.LetterHTML")
+    mock_html.return_value.write_pdf.return_value = b"%PDF"
+
+    with set_config(app, "RENDER_POOL_SOCKET_PATH", render_pool.socket_path):
+        with app.test_request_context(""):
+            html = HTML("<p>Hello</p>")
+        assert isinstance(html, PooledHTML)
+        assert html.write_pdf() == b"%PDF"
+
+
+def test_pooled_html_renders_in_process_if_the_render_pool_is_not_running(app, mocker, tmp_path):
+    mock_html = mocker.patch("app.render_pool.LetterHTML")
+    mock_html.return_value.write_pdf.return_value = b"%PDF"
+    mock_incr = mocker.patch.object(app.statsd_client, "incr")
+
+    with set_config(app, "RENDER_POOL_SOCKET_PATH", str(tmp_path / "missing.sock")):
+        with app.test_request_context("/preview.pdf"):
+            html = HTML("<p>Hello</p>")
+        assert html.write_pdf() == b"%PDF"
+
+    mock_html.assert_called_once_with("<p>Hello</p>")
+    mock_incr.assert_called_once_with("render-pool.fallback")
+
+
+@pytest.mark.parametrize("peak_rss_kilobytes, expected_recycle", [(1024, False), (2048, True)])
+def test_render_pool_recycles_workers_by_peak_rss(app, mocker, peak_rss_kilobytes, expected_recycle):
+    mocker.patch("app.render_pool.resource.getrusage").return_value.ru_maxrss = peak_rss_kilobytes
+    pool = RenderPool(app, "render.sock", processes=1, max_rss_bytes=1024 * 1024)
+
+    assert pool.should_recycle() is expected_recycle
@@ -1,4 +1,5 @@
 import json
+import os
 
 from flask import url_for
 
@@ -11,6 +12,7 @@ def test_status_returns_binary_versions(client):
 
     assert json_data["ghostscript_version"] is not None
     assert json_data["imagemagick_version"] is not None
+    assert json_data["letter_cache_namespace"] == "test"
 
 
 def test_simple_status_returns_ok(client):
@@ -18,3 +20,18 @@ def test_simple_status_returns_ok(client):
 
     assert resp.status_code == 200
     assert resp.get_data(as_text=True) == "ok"
+
+
+def test_cache_stats_returns_rolling_stats_for_this_worker(app, client, auth_header, mocker):
+    mocker.patch.object(app.cache, "stats", mocker.Mock(**{"snapshot.return_value": {"stats": {}}}))
+
+    resp = client.get(url_for("status_blueprint.cache_stats"), headers=auth_header)
+
+    assert resp.status_code == 200
+    assert resp.json == {"pid": os.getpid(), "stats": {}}
+
+
+def test_cache_stats_requires_auth(client):
+    resp = client.get(url_for("status_blueprint.cache_stats"))
+
+    assert resp.status_code == 401
@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+from flask import current_app, request
+
+from app.templated import render_languages
+from tests.conftest import set_config
+
+
+@pytest.fixture
+def render_pool_socket(app, tmp_path):
+    with set_config(app, "RENDER_POOL_SOCKET_PATH", str(tmp_path / "render.sock")):
+        yield
+
+
+def test_render_languages_renders_one_after_the_other_without_a_render_pool(app):
+    calls = []
+
+    with app.app_context():
+        results = render_languages(
+            lambda: calls.append(threading.current_thread()) or "welsh",
+            lambda: calls.append(threading.current_thread()) or "english",
+        )
+
+    assert results == ["welsh", "english"]
+    assert calls == [threading.current_thread(), threading.current_thread()]
+
+
+def test_render_languages_renders_at_the_same_time_with_a_render_pool(app, render_pool_socket):
+    # each render waits for the other to start, so this only finishes if they run at the same time
+    both_started = threading.Barrier(2, timeout=5)
+
+    def render(language):
+        both_started.wait()
+        return language
+
+    with app.test_request_context("/preview.pdf"):
+        results = render_languages(lambda: render("welsh"), lambda: render("english"))
+
+    assert results == ["welsh", "english"]
+
+
+def test_render_languages_renders_one_after_the_other_if_turned_off(app, render_pool_socket):
+    with set_config(app, "RENDER_LANGUAGES_IN_PARALLEL", False), app.app_context():
+        results = render_languages(threading.current_thread, threading.current_thread)
+
+    assert results == [threading.current_thread(), threading.current_thread()]
+
+
+def test_render_languages_copies_the_request_context(app, render_pool_socket):
+    with app.test_request_context("/preview.pdf"):
+        results = render_languages(lambda: request.path, lambda: request.path)
+
+    assert results == ["/preview.pdf", "/preview.pdf"]
+
+
+def test_render_languages_copies_the_app_context(app, render_pool_socket):
+    with app.app_context():
+        results = render_languages(lambda: current_app.name, lambda: current_app.name)
+
+    assert results == [app.name, app.name]
+
+
+def test_render_languages_raises_errors_from_renders(app, render_pool_socket):
+    def fail():
+        raise ValueError("Failed to load image")
+
+    with app.app_context(), pytest.raises(ValueError, match="Failed to load image"):
+        render_languages(lambda: "welsh", fail)
@@ -9,6 +9,7 @@ from weasyprint import HTML
 from app.precompiled import _is_page_A4_portrait
 from app.transformation import (
     convert_pdf_to_cmyk,
+    convert_pdfs_to_cmyk,
     does_pdf_contain_cmyk,
     does_pdf_contain_rgb,
 )
@@ -92,6 +93,34 @@ def test_convert_pdf_to_cmyk(client, data):
     assert does_pdf_contain_cmyk(result)
 
 
+def test_convert_pdfs_to_cmyk_converts_them_together(client, mocker):
+    mock_convert = mocker.patch("app.transformation.convert_pdf_to_cmyk", wraps=convert_pdf_to_cmyk)
+    pdfs = [BytesIO(rgb_image_pdf), BytesIO(multi_page_pdf), BytesIO(cmyk_and_rgb_images_in_one_pdf)]
+
+    results = convert_pdfs_to_cmyk(pdfs)
+
+    assert mock_convert.call_count == 1
+    assert [len(PdfReader(result).pages) for result in results] == [
+        len(PdfReader(BytesIO(pdf)).pages) for pdf in (rgb_image_pdf, multi_page_pdf, cmyk_and_rgb_images_in_one_pdf)
+    ]
+    for result in results:
+        result.seek(0)
+        assert result.read(9) == b"%PDF-1.7\n"
+        assert not does_pdf_contain_rgb(result)
+
+
+def test_convert_pdfs_to_cmyk_converts_one_at_a_time_if_pages_go_missing(client, mocker):
+    mock_convert = mocker.patch(
+        "app.transformation.convert_pdf_to_cmyk",
+        side_effect=[BytesIO(rgb_image_pdf), BytesIO(rgb_image_pdf), BytesIO(multi_page_pdf)],
+    )
+
+    results = convert_pdfs_to_cmyk([BytesIO(rgb_image_pdf), BytesIO(multi_page_pdf)])
+
+    assert mock_convert.call_count == 3
+    assert [result.getvalue() for result in results] == [rgb_image_pdf, multi_page_pdf]
+
+
 def test_convert_pdf_to_cmyk_preserves_black(client):
     data = BytesIO(rgb_black_pdf)
     assert does_pdf_contain_rgb(data)
@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+import weasyprint
+
+from app.weasyprint_hack import LetterHTML, RenderContext
+
+TWO_PARAGRAPHS = "<html><head>{style}</head><body><p>One</p><p>Two</p></body></html>"
+PAGE_BREAK = "p:first-child { break-after: page; }"
+
+
+@pytest.mark.parametrize(
+    "style, expected_page_count",
+    [
+        ("", 1),
+        (f"<style>{PAGE_BREAK}</style>", 2),
+        (f'<style type="text/css">{PAGE_BREAK}</style>', 2),
+        (f'<style media="print">{PAGE_BREAK}</style>', 2),
+        (f'<style media="screen">{PAGE_BREAK}</style>', 1),
+    ],
+)
+def test_letter_html_applies_letter_styles(app, style, expected_page_count):
+    with app.test_request_context(""):
+        html = LetterHTML(string=TWO_PARAGRAPHS.format(style=style))
+
+    assert len(html.render().pages) == expected_page_count
+
+
+def test_letter_html_only_parses_each_stylesheet_once(app, mocker):
+    mock_css = mocker.patch("app.weasyprint_hack.weasyprint.CSS", wraps=weasyprint.CSS)
+    RenderContext.get().stylesheets.clear()
+
+    for _ in range(3):
+        with app.test_request_context(""):
+            html = LetterHTML(string=TWO_PARAGRAPHS.format(style=f"<style>{PAGE_BREAK}</style>"))
+        assert len(html.render().pages) == 2
+
+    mock_css.assert_called_once()
+
+
+def test_letter_html_shares_stylesheets_between_urls(app, mocker):
+    mock_css = mocker.patch("app.weasyprint_hack.weasyprint.CSS", wraps=weasyprint.CSS)
+    RenderContext.get().stylesheets.clear()
+
+    for url in ["/preview.png?page=1", "/preview.png?page=2&dpi=72", "/preview-pages.json"]:
+        with app.test_request_context(url):
+            LetterHTML(string=TWO_PARAGRAPHS.format(style=f"<style>{PAGE_BREAK}</style>"))
+
+    mock_css.assert_called_once()
+    assert mock_css.call_args[1]["base_url"] == "http://localhost/"
+
+
+def test_letter_html_renders_with_the_render_context_fonts(app, mocker):
+    mock_render = mocker.patch("app.weasyprint_hack.weasyprint.HTML.render")
+
+    with app.test_request_context(""):
+        LetterHTML(string=TWO_PARAGRAPHS.format(style="")).write_pdf()
+
+    assert mock_render.call_args[0] == (RenderContext.get().font_config, RenderContext.get().counter_style)
+
+
+def test_render_context_keeps_a_bounded_number_of_stylesheets(mocker):
+    mocker.patch("app.weasyprint_hack.weasyprint.CSS", side_effect=lambda string, **kwargs: string)
+    render_context = RenderContext()
+
+    for i in range(RenderContext.MAX_STYLESHEETS + 1):
+        render_context.stylesheet(f"p {{ margin: {i}px }}", "http://localhost/", None)
+
+    assert len(render_context.stylesheets) == RenderContext.MAX_STYLESHEETS
+    assert ("p { margin: 0px }", "http://localhost/") not in render_context.stylesheets
+
+
+def test_render_context_is_per_thread():
+    contexts = []
+    thread = threading.Thread(target=lambda: contexts.append(RenderContext.get()))
+    thread.start()
+    thread.join()
+
+    assert RenderContext.get() is RenderContext.get()
+    assert contexts[0] is not RenderContext.get()